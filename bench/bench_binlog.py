@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Decode the same markers written as a text log and as a binary log.
+#
+#   python bench/bench_binlog.py [markers]
+
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "logwriter", "python"))
+
+import VizexecLogWriter as vze
+from binlog import BinaryDecoder
+from seqdata import parse_line
+
+
+def write_markers(count, format_record, header):
+    out = [header]
+    vze.write_log_raw = out.append
+    vze.binary_strings.clear()
+    for i in range(count // 2):
+        out.append(format_record((i * 2, "CAL", "140213", i * 2, "function_name_{0}".format(i % 100))))
+        out.append(format_record((i * 2 + 1, "RET", "140213", i * 2 + 1)))
+    return "".join(out)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) >= 2 else 1000000
+    text = write_markers(count, vze.format_text_record, "")
+    binary = write_markers(count, vze.format_binary_record, "")
+    print "{0} markers: text {1:.1f} MB, binary {2:.1f} MB".format(
+        count, len(text) / 1e6, len(binary) / 1e6)
+
+    start = time.time()
+    batch = [(parse_line(line), line) for line in text.split("\n")]
+    elapsed = time.time() - start
+    print "  text   {0:12.0f} markers/sec".format(count / elapsed)
+
+    start = time.time()
+    batch = BinaryDecoder().feed(binary)
+    elapsed = time.time() - start
+    print "  binary {0:12.0f} markers/sec".format(count / elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Indexing communications whose receives come delay lines after their
+# sends, and finding those crossing views of the log.
+#
+#   python bench/bench_comm_index.py [comms [delay [views]]]
+
+import sys
+import os
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import SequenceData, parse_line
+
+
+def log_lines(comms, delay):
+    random.seed(1)
+    lines = []
+    receives = {}
+    for i in range(comms + delay):
+        if i < comms:
+            lines.append('SND {0} "{1}" "msg{1}"'.format(random.randint(0, 7), i))
+            receives.setdefault(i + random.randint(0, delay), []).append(i)
+        for j in receives.pop(i, ()):
+            lines.append('RCV {0} "{1}" "msg{2}"'.format(random.randint(8, 15), i, j))
+    return lines
+
+
+def main():
+    comms = int(sys.argv[1]) if len(sys.argv) >= 2 else 20000
+    delay = int(sys.argv[2]) if len(sys.argv) >= 3 else 5000
+    views = int(sys.argv[3]) if len(sys.argv) >= 4 else 1000
+    lines = log_lines(comms, delay)
+
+    seqdata = SequenceData()
+    start = time.time()
+    seqdata.add_data_cmds([(parse_line(line), line) for line in lines])
+    elapsed = time.time() - start
+    entries = sum(len(bucket) for bucket in seqdata.comm_buckets.itervalues())
+    print "{0} comms, delay {1} lines: {2:.2f} sec, {3} bucket entries, {4} long comms".format(
+        comms, delay, elapsed, entries, len(getattr(seqdata, "long_comms", ())))
+
+    random.seed(2)
+    height = seqdata.get_height()
+    start = time.time()
+    found = 0
+    for i in range(views):
+        y0 = random.randrange(height)
+        found += len(seqdata.comms_in_range(y0, y0 + 800))
+    elapsed = time.time() - start
+    print "{0} views: {1:.1f} msec/view, {2:.0f} comms/view".format(
+        views, elapsed / views * 1000, found / float(views))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Many connections, each running a few lifelines at a time, with the
+# lifelines of every connection terminated when it is closed.
+#
+#   python bench/bench_lanes.py [connections [lifelines per connection]]
+
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import SequenceData
+
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) >= 2 else 2000
+    lifelines = int(sys.argv[2]) if len(sys.argv) >= 3 else 4
+    seqdata = SequenceData()
+    open_groups = []
+    start = time.time()
+    for i in range(connections):
+        group = "g{0}".format(i + 1)
+        for t in range(lifelines):
+            seqdata.add_data_line('CAL {0} "" "main"'.format(t), group)
+        open_groups.append(group)
+        # Half of the connections stay open until the end.
+        if i % 2:
+            seqdata.terminated_lifeline_group(open_groups.pop(0))
+    for group in open_groups:
+        seqdata.terminated_lifeline_group(group)
+    print "{0} connections of {1} lifelines, {2} lanes: {3:.2f} sec".format(
+        connections, lifelines, seqdata.max_lane + 1, time.time() - start)
+
+if __name__ == "__main__":
+    main()
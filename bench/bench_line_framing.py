@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Push log lines through a loopback socket and split them with LineFramer,
+# compared with the find/slice loop of the former TCPLogHandler.
+#
+#   python bench/bench_line_framing.py [megabytes]
+
+import sys
+import os
+import socket
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from vizexec_server import LineFramer
+
+
+def make_block():
+    lines = []
+    for i in range(10000):
+        lines.append('CAL 140213 "{0}" "function_name_{1}"'.format(i, i % 100))
+        lines.append('RET 140213 "{0}"'.format(i))
+    return "\n".join(lines) + "\n"
+
+
+def sender(sock, block, total):
+    sent = 0
+    while sent < total:
+        sock.sendall(block)
+        sent += len(block)
+    sock.close()
+
+
+def connect_pair():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, addr = listener.accept()
+    listener.close()
+    return client, server
+
+
+def recv_framer(sock):
+    framer = LineFramer()
+    count = 0
+    while True:
+        lines = framer.recv_from(sock)
+        if lines is None:
+            return count
+        count += len(lines)
+
+
+def recv_slicing(sock):
+    # The loop the former TCPLogHandler.handle used before LineFramer.
+    buf = ""
+    count = 0
+    while True:
+        idx = buf.find("\n")
+        if idx == -1:
+            recved = sock.recv(4096)
+            if not recved:
+                return count
+            buf += recved
+            continue
+        line = buf[:idx]
+        buf = buf[idx + 1:]
+        count += 1
+
+
+def bench(name, receiver, block, total):
+    client, server = connect_pair()
+    thread = threading.Thread(target = sender, args = (client, block, total))
+    start = time.time()
+    thread.start()
+    count = receiver(server)
+    elapsed = time.time() - start
+    thread.join()
+    server.close()
+    print "  {0:10s} {1:8.1f} MB/s {2:12.0f} lines/sec".format(
+        name, total / elapsed / 1e6, count / elapsed)
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) >= 2 else 100
+    block = make_block()
+    total = (megabytes * 1000000 // len(block) + 1) * len(block)
+    print "{0:.0f} MB over loopback".format(total / 1e6)
+    bench("LineFramer", recv_framer, block, total)
+    bench("slicing", recv_slicing, block, total)
+
+if __name__ == "__main__":
+    main()
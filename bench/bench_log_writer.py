@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Overhead of a call()/ret() marker pair of the Python VizexecLogWriter,
+# compared with the old unbuffered writer that flushed every marker.
+#
+#   python bench/bench_log_writer.py [pairs]
+
+import sys
+import os
+import time
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "logwriter", "python"))
+
+import VizexecLogWriter as vze
+
+
+def old_writer(f):
+    # write_log_notime before per-thread buffering.
+    counter = [0]
+    def write_log(logtype, *params):
+        counter[0] += 1
+        line = str(logtype) + " " + str(id(threading.currentThread()))
+        for p in (counter[0], ) + params:
+            line += ' "{0}"'.format(str(p))
+        f.write(line + "\n")
+        f.flush()
+    return write_log
+
+
+def bench_old(pairs, filename):
+    f = open(filename, "wb")
+    write_log = old_writer(f)
+    start = time.time()
+    for i in range(pairs):
+        write_log("CAL", "function_name")
+        write_log("RET")
+    elapsed = time.time() - start
+    f.close()
+    return elapsed, elapsed
+
+
+def bench_buffered(pairs, filename, logformat):
+    os.environ["VIZEXEC_LOGFILE"] = filename
+    os.environ["VIZEXEC_LOGFORMAT"] = logformat
+    vze.start()
+    start = time.time()
+    for i in range(pairs):
+        vze.call("function_name")
+        vze.ret()
+    elapsed = time.time() - start
+    vze.stop()
+    return elapsed, time.time() - start
+
+
+def main():
+    pairs = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    filename = tempfile.mktemp(suffix = ".log")
+    results = [
+        ("unbuffered", bench_old(pairs, filename)),
+        ("text", bench_buffered(pairs, filename, "text")),
+        ("binary", bench_buffered(pairs, filename, "binary")),
+    ]
+    os.remove(filename)
+    print "{0} call/ret pairs".format(pairs)
+    for name, (marking, total) in results:
+        print "  {0:10s} {1:8.0f} ns/marker  {2:8.0f} ns/marker including flush".format(
+            name, marking / (pairs * 2) * 1e9, total / (pairs * 2) * 1e9)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Opening a log with a full layout, by building its sidecar index, and by
+# reopening it with the saved index, each followed by drawing a view at
+# the middle of the log.
+#
+#   python bench/bench_logindex.py [LOGFILE | lines]
+
+import sys
+import os
+import gc
+import time
+import random
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import cairo
+from seqdata import SequenceData
+from logindex import open_index, INDEX_SUFFIX
+
+
+def write_log(filename, lines):
+    random.seed(1)
+    f = open(filename, "w")
+    depth = [0] * 8
+    for i in range(lines):
+        t = random.randint(0, 7)
+        r = random.random()
+        if (r < 0.45 and depth[t] < 30) or depth[t] == 0:
+            depth[t] += 1
+            f.write('CAL {0} "{1}" "func_{2}"\n'.format(t, i, random.randint(0, 40)))
+        elif r < 0.85:
+            depth[t] -= 1
+            f.write('RET {0} "{1}"\n'.format(t, i))
+        elif r < 0.9:
+            f.write('SND {0} "{1}" "msg{1}"\n'.format(t, i))
+            f.write('RCV {0} "{1}" "msg{1}"\n'.format((t + 1) % 8, i))
+        else:
+            f.write('EVT {0} "{1}" "event"\n'.format(t, i))
+    f.close()
+
+
+def draw_middle(seqdata):
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, 1200, 800)
+    seqdata.draw(cairo.Context(surface), 0, seqdata.get_height() // 2, 1200, 800)
+
+
+def full_load(filename):
+    seqdata = SequenceData()
+    seqdata.read_file(filename)
+    seqdata.unblock_all()
+    return seqdata
+
+
+def main():
+    arg = sys.argv[1] if len(sys.argv) >= 2 else "200000"
+    if os.path.exists(arg):
+        filename = arg
+    else:
+        filename = tempfile.mktemp(suffix = ".log")
+        write_log(filename, int(arg))
+    if os.path.exists(filename + INDEX_SUFFIX):
+        os.remove(filename + INDEX_SUFFIX)
+
+    print "{0}: {1:.1f} MB".format(filename, os.path.getsize(filename) / 1e6)
+    for name, load in [("full layout", full_load), ("build index", open_index), ("reopen", open_index)]:
+        start = time.time()
+        seqdata = load(filename)
+        opened = time.time() - start
+        draw_middle(seqdata)
+        print "  {0:12s} {1:8.2f} sec to open {2:8.2f} sec to first view".format(
+            name, opened, time.time() - start)
+        # Lifelines and their SequenceData refer to each other.
+        seqdata = None
+        gc.collect()
+
+    os.remove(filename + INDEX_SUFFIX)
+    if filename != arg:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Searching a name index holding postings of many entities for the next
+# and previous match of a few queries.
+#
+#   python bench/bench_name_search.py [postings [names]]
+
+import sys
+import os
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from nameindex import NameIndex
+
+
+def main():
+    postings = int(sys.argv[1]) if len(sys.argv) >= 2 else 10000000
+    names = int(sys.argv[2]) if len(sys.argv) >= 3 else 20000
+    random.seed(1)
+    index = NameIndex()
+    start = time.time()
+    for i in xrange(postings):
+        name = i % names
+        index.add("module{0}.func_{1}".format(name % 97, name), i % 64, i * 20)
+    print "{0} postings of {1} names: indexed in {2:.1f} sec".format(postings, names, time.time() - start)
+
+    for text in ("func_123", "func_1", "module5.", "nomatch"):
+        times = []
+        for backward in (False, True) * 50:
+            ypos = random.randint(0, postings * 20)
+            start = time.time()
+            index.find(text, ypos, 0, backward)
+            times.append(time.time() - start)
+        times.sort()
+        print "  {0:10s} {1:6d} names {2:8.2f} ms median {3:8.2f} ms max".format(
+            text, len(index.names_matching(text)), times[len(times) // 2] * 1000, times[-1] * 1000)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Drawing a 700 pixel tall view of a whole log: every event scaled down,
+# against the lane summaries at the zoom fitting the log in the view.
+#
+#   python bench/bench_overview.py [lines]
+
+import sys
+import os
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import cairo
+from seqdata import SequenceData
+from bench_logindex import write_log
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    filename = tempfile.mktemp(suffix = ".log")
+    write_log(filename, lines)
+    seqdata = SequenceData()
+    seqdata.read_file(filename)
+    seqdata.unblock_all()
+    os.remove(filename)
+
+    height = seqdata.get_height()
+    zoom = 700.0 / height
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, 1200, 700)
+    print "{0} lines, {1} ypos, zoom {2:.5f}".format(lines, height, zoom)
+
+    start = time.time()
+    ctx = cairo.Context(surface)
+    ctx.scale(1, zoom)
+    seqdata.draw(ctx, 0, 0, 1200, height)
+    print "  {0:10s} {1:8.3f} sec".format("events", time.time() - start)
+
+    # The first draw at a zoom brings the coarser summary levels up to date.
+    for name in ("summaries", "again"):
+        start = time.time()
+        seqdata.draw_overview(cairo.Context(surface), 0, 0, 1200, height, zoom)
+        print "  {0:10s} {1:8.3f} sec".format(name, time.time() - start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tokenizing a text log in the reading process and in pools of processes,
+# and building its sidecar index both ways.
+#
+#   python bench/bench_parallel_parse.py [LOGFILE | lines [processes...]]
+
+import sys
+import os
+import gc
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import parse_line
+from parallelparse import ParallelParser
+from logindex import LogSource, LogIndex, CHECKPOINT_BYTES
+from bench_logindex import write_log
+
+
+def tokenize(source, processes):
+    chunks = source.text_chunks(source.start, 1024 * 1024)
+    if processes == 1:
+        for end, text in chunks:
+            [(parse_line(line), line) for line in text.split("\n")]
+        return
+    parser = ParallelParser(processes)
+    try:
+        for end, batch in parser.parse(chunks):
+            pass
+    finally:
+        parser.close()
+
+
+def build(source, processes):
+    LogIndex().build(source, CHECKPOINT_BYTES, processes)
+
+
+def main():
+    arg = sys.argv[1] if len(sys.argv) >= 2 else "1000000"
+    counts = [int(n) for n in sys.argv[2:]] or [1, 2, 4]
+    if os.path.exists(arg):
+        filename = arg
+    else:
+        filename = tempfile.mktemp(suffix = ".log")
+        write_log(filename, int(arg))
+
+    source = LogSource(filename)
+    print "{0}: {1:.1f} MB".format(filename, source.size / 1e6)
+    for name, run in [("tokenize", tokenize), ("build index", build)]:
+        for processes in counts:
+            start = time.time()
+            run(source, processes)
+            print "  {0:12s} {1:2d} processes {2:8.2f} sec".format(name, processes, time.time() - start)
+            gc.collect()
+
+    source.close()
+    if filename != arg:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Memory held by the raw log of a long session, and time to save it.
+# Run once per setting, as peak memory is per process:
+#
+#   python bench/bench_rawlog.py [lines]
+#   VIZEXEC_RAWLOG_COMPRESS=1 python bench/bench_rawlog.py [lines]
+
+import sys
+import os
+import time
+import resource
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import SequenceData
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) >= 2 else 1000000
+    seqdata = SequenceData()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for i in xrange(lines):
+        seqdata.keep_raw_log(arr = ["CAL", "g1/{0}".format(i % 8), str(i), "function name {0}".format(i % 100)])
+    grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    filename = tempfile.mktemp(suffix = ".log")
+    start = time.time()
+    seqdata.save_log_to(filename)
+    print "{0} lines: {1:.1f} MB more memory, saved {2:.1f} MB in {3:.2f} sec".format(
+        lines, grown / 1024.0, os.path.getsize(filename) / 1e6, time.time() - start)
+    os.remove(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Laying out a log whose receives come before their sends: every thread
+# receives messages that a sender thread sends delay lines later.
+#
+#   python bench/bench_recv_match.py [lines [delay]]
+
+import sys
+import os
+import time
+import random
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import SequenceData
+
+
+def write_log(filename, lines, delay):
+    random.seed(1)
+    f = open(filename, "w")
+    sends = {}
+    for i in range(lines):
+        t = random.randint(0, 7)
+        f.write('RCV {0} "{1}" "msg{1}"\n'.format(t, i))
+        sends.setdefault(i + delay, []).append(i)
+        for j in sends.pop(i, ()):
+            f.write('SND 8 "{0}" "msg{1}"\n'.format(i, j))
+        f.write('EVT {0} "{1}" "event"\n'.format(random.randint(0, 7), i))
+    f.close()
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) >= 2 else 100000
+    delay = int(sys.argv[2]) if len(sys.argv) >= 3 else 20000
+    filename = tempfile.mktemp(suffix = ".log")
+    write_log(filename, lines, delay)
+    start = time.time()
+    seqdata = SequenceData()
+    seqdata.read_file(filename)
+    seqdata.unblock_all()
+    print "{0} messages received {1} lines before sent: {2:.2f} sec".format(
+        lines, delay, time.time() - start)
+    print seqdata.diag.summary()
+    os.remove(filename)
+
+if __name__ == "__main__":
+    main()
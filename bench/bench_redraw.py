@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Streaming a log into a view in batches every 10 ms, redrawn as by the
+# former 10 ms poll (all of the view whenever something changed) and as by
+# the redraw scheduler (only what changed within the view, at most 30 frames
+# a second), with the view kept at the top of the log or following its end.
+#
+#   python bench/bench_redraw.py [LOGFILE | lines [lines per second]]
+
+import sys
+import os
+import gc
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import cairo
+from seqdata import SequenceData, parse_line, summary_top
+from tilecache import TileCache
+from bench_logindex import write_log
+
+VIEW_WIDTH = 1200
+VIEW_HEIGHT = 800
+BATCH_SECONDS = 0.01
+
+
+class View:
+    def __init__(self, seqdata, follow):
+        self.seqdata = seqdata
+        self.follow = follow
+        self.offset_y = 0
+        self.tile_cache = TileCache(self.render_tile)
+        self.surface = cairo.ImageSurface(cairo.FORMAT_RGB24, VIEW_WIDTH, VIEW_HEIGHT)
+        self.frames = 0
+        self.pixels = 0
+        self.paint_seconds = 0.0
+
+    def render_tile(self, ctx, offset_x, offset_y, w, h, zoom):
+        self.seqdata.draw_content(ctx, offset_x, offset_y, w, h)
+
+    def scroll(self):
+        """ Follow the end of the log, True if the view moved """
+        if not self.follow:
+            return False
+        offset_y = max(self.seqdata.get_height() - VIEW_HEIGHT, 0)
+        moved = offset_y != self.offset_y
+        self.offset_y = offset_y
+        return moved
+
+    def invalidate(self):
+        regions = self.seqdata.take_dirty_regions()
+        for x0, y0, x1, y1 in regions:
+            self.tile_cache.invalidate(x0, summary_top(y0, 1.0), x1, y1)
+        return regions
+
+    def paint(self, rects):
+        start = time.time()
+        ctx = cairo.Context(self.surface)
+        for rect in rects:
+            ctx.rectangle(*rect)
+        ctx.clip()
+        self.tile_cache.paint(ctx, 0, self.offset_y, VIEW_WIDTH, VIEW_HEIGHT)
+        self.seqdata.draw_overlay(ctx, 0, self.offset_y, VIEW_WIDTH, VIEW_HEIGHT)
+        self.paint_seconds += time.time() - start
+        self.frames += 1
+        self.pixels += sum(w * h for x, y, w, h in rects)
+
+    def poll_frame(self):
+        # What the 10 ms poll did when the updated flag was set.
+        self.invalidate()
+        self.scroll()
+        self.paint([(0, 0, VIEW_WIDTH, VIEW_HEIGHT)])
+
+    def scheduled_frame(self):
+        regions = self.invalidate()
+        if self.scroll():
+            self.paint([(0, 0, VIEW_WIDTH, VIEW_HEIGHT)])
+            return
+        rects = []
+        for x0, y0, x1, y1 in regions:
+            y0 = max(y0 - self.offset_y, 0)
+            x1 = min(x1, VIEW_WIDTH)
+            if x0 < x1 and y0 < VIEW_HEIGHT:
+                rects.append((x0, y0, x1 - x0, VIEW_HEIGHT - y0))
+        if rects:
+            self.paint(rects)
+
+
+def stream(lines, rate, follow, scheduled):
+    seqdata = SequenceData()
+    view = View(seqdata, follow)
+    batch_lines = max(int(rate * BATCH_SECONDS), 1)
+    frame_interval = 1.0 / 30
+    last_frame = -frame_interval
+    pending = False
+    # Time of the stream, each batch arriving BATCH_SECONDS after the previous one.
+    for i in range(0, len(lines), batch_lines):
+        now = i // batch_lines * BATCH_SECONDS
+        seqdata.add_data_cmds([(parse_line(line), line) for line in lines[i:i + batch_lines]])
+        if not scheduled:
+            view.poll_frame()
+            continue
+        pending = True
+        if now - last_frame >= frame_interval:
+            view.scheduled_frame()
+            last_frame = now
+            pending = False
+    if pending:
+        view.scheduled_frame()
+    return view, len(lines) / float(rate)
+
+
+def main():
+    arg = sys.argv[1] if len(sys.argv) >= 2 else "100000"
+    rate = int(sys.argv[2]) if len(sys.argv) >= 3 else 20000
+    if os.path.exists(arg):
+        filename = arg
+    else:
+        filename = tempfile.mktemp(suffix = ".log")
+        write_log(filename, int(arg))
+    lines = open(filename).read().splitlines()
+
+    print "{0}: {1} lines at {2} lines/sec".format(filename, len(lines), rate)
+    for follow in (False, True):
+        for scheduled in (False, True):
+            view, seconds = stream(lines, rate, follow, scheduled)
+            print "  {0:12s} {1:9s} {2:6d} frames {3:8.1f} Mpixels {4:7.2f} sec painting, {5:.0f}% of the stream".format(
+                "following" if follow else "at the top", "scheduled" if scheduled else "poll",
+                view.frames, view.pixels / 1e6, view.paint_seconds, view.paint_seconds / seconds * 100)
+            view = None
+            gc.collect()
+
+    if filename != arg:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main()
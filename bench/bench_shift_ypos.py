@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Repeated Lifeline.shift_ypos on a lifeline with many entities.
+#
+#   python bench/bench_shift_ypos.py [entities] [shifts]
+
+import sys
+import os
+import time
+import random
+import bisect
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import SequenceData
+
+
+def main():
+    entities = int(sys.argv[1]) if len(sys.argv) >= 2 else 1000000
+    shifts = int(sys.argv[2]) if len(sys.argv) >= 3 else 1000
+
+    seqdata = SequenceData()
+    lifeline = seqdata.get_lifeline("d/0")
+    start = time.time()
+    for i in range(entities):
+        lifeline.put_event("event")
+    print "build {0} entities: {1:.2f} sec".format(entities, time.time() - start)
+
+    random.seed(0)
+    points = [random.randrange(seqdata.current_ypos) for i in range(shifts)]
+    start = time.time()
+    for ypos in points:
+        lifeline.shift_ypos(ypos, ypos + 10)
+    elapsed = time.time() - start
+    print "{0} shifts: {1:.3f} sec ({2:.1f} usec/shift)".format(
+        shifts, elapsed, elapsed / shifts * 1e6)
+
+    # The old implementation rewrote every later ypos; time a few of those.
+    plain = list(lifeline.events.raw_ypos)
+    start = time.time()
+    for ypos in points[:10]:
+        idx = bisect.bisect_left(plain, ypos)
+        for i in range(idx, len(plain)):
+            plain[i] += 10
+    elapsed = time.time() - start
+    print "old O(n) shift: {0:.1f} usec/shift".format(elapsed / 10 * 1e6)
+
+    start = time.time()
+    ylist = lifeline.events.ypos
+    for ypos in points:
+        bisect.bisect_left(ylist, ypos)
+    elapsed = time.time() - start
+    print "{0} bisect lookups: {1:.1f} usec/lookup".format(shifts, elapsed / shifts * 1e6)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Compare shlex.split with logtokenizer.split_line on log lines.
+#
+#   python bench/bench_tokenizer.py [logfile ...]
+
+import sys
+import os
+import shlex
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "logwriter", "python"))
+
+from logtokenizer import split_line
+import VizexecLogWriter as vze
+
+
+def writer_lines(count):
+    # Markers are buffered per thread until write_buffered() formats them in chunks.
+    chunks = []
+    vze.write_log_raw = chunks.append
+    vze.flush_log_raw = vze.DoNothing
+    for i in range(count // 4):
+        vze.call("func_%d" % (i % 100))
+        vze.event("event name %d" % i)
+        vze.send("msg", i)
+        vze.ret()
+    vze.write_buffered()
+    vze.write_log_raw = None
+    return "".join(chunks).splitlines(True)
+
+
+def bench(name, func, lines):
+    start = time.time()
+    for line in lines:
+        func(line.strip())
+    elapsed = time.time() - start
+    print "  {0:12s} {1:12.0f} lines/sec".format(name, len(lines) / elapsed)
+
+
+def main():
+    inputs = [("writer", writer_lines(200000))]
+    for fn in sys.argv[1:] or [os.path.join(os.path.dirname(__file__), "..", "sample1.log")]:
+        lines = open(fn).readlines()
+        inputs.append((fn, lines * max(1, 200000 // max(len(lines), 1))))
+
+    for name, lines in inputs:
+        for line in lines:
+            if shlex.split(line.strip()) != split_line(line.strip()):
+                print "Token mismatch:", repr(line)
+                sys.exit(1)
+        print "{0} ({1} lines)".format(name, len(lines))
+        bench("shlex", shlex.split, lines)
+        bench("split_line", split_line, lines)
+
+if __name__ == "__main__":
+    main()
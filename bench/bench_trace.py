@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Slowdown of a recursive workload traced by VizexecLogWriter.set_trace
+# with various filters, compared with the old sys.settrace tracer.
+#
+#   python bench/bench_trace.py [n]
+
+import sys
+import os
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "logwriter", "python"))
+
+import VizexecLogWriter as vze
+
+
+def fib(n):
+    if n < 2:
+        return n
+    return add(fib(n - 1), fib(n - 2))
+
+def add(a, b):
+    return a + b
+
+
+def old_trace_func(frame, event, arg):
+    # The tracer set_trace installed with sys.settrace.
+    if event == "call":
+        vze.call(frame.f_code.co_name)
+    if event == "return":
+        vze.ret()
+    return old_trace_func
+
+
+def run(n, setup):
+    setup()
+    start = time.time()
+    fib(n)
+    elapsed = time.time() - start
+    sys.settrace(None)
+    vze.unset_trace()
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) >= 2 else 20
+    os.environ["VIZEXEC_LOGFILE"] = tempfile.mktemp(suffix = ".log")
+    vze.start()
+    cases = [
+        ("untraced", lambda: None),
+        ("settrace (old)", lambda: sys.settrace(old_trace_func)),
+        ("all calls", lambda: vze.set_trace()),
+        ("exclude add", lambda: vze.set_trace(exclude_functions = ["add"])),
+        ("max_depth 5", lambda: vze.set_trace(max_depth = 5)),
+        ("sample_rate 10", lambda: vze.set_trace(include_functions = ["add"], sample_rate = 10)),
+        ("exclude all", lambda: vze.set_trace(exclude_modules = ["*"])),
+    ]
+    base = None
+    print "fib({0})".format(n)
+    for name, setup in cases:
+        elapsed = run(n, setup)
+        base = base or elapsed
+        print "  {0:16s} {1:8.3f} sec  x{2:.1f}".format(name, elapsed, elapsed / base)
+    vze.stop()
+    os.remove(os.environ["VIZEXEC_LOGFILE"])
+
+if __name__ == "__main__":
+    main()
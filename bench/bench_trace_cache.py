@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Reading a log through ReadThread without the cache, into an empty cache,
+# from the cache, and after the log has grown by a tenth.
+#
+#   python bench/bench_trace_cache.py [lines]
+
+import sys
+import os
+import gc
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import SequenceData
+from tracecache import TraceCache
+from tilecache import TileCache
+from vizexec_server import ReadThread
+from bench_logindex import write_log
+
+
+class Window:
+    """ The parts of VizexecGUI used by ReadThread """
+    def __init__(self, trace_cache):
+        self.seqdata = SequenceData()
+        self.seqdata_lock = threading.RLock()
+        self.tile_cache = TileCache(None, 0)
+        self.trace_cache = trace_cache
+
+    def new_thread_group_id(self):
+        return "g1"
+
+    def request_redraw(self):
+        pass
+
+
+def read(filename, trace_cache):
+    start = time.time()
+    ReadThread(filename, Window(trace_cache)).run()
+    elapsed = time.time() - start
+    gc.collect()
+    return elapsed
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "bench.log")
+    write_log(filename, lines)
+    data = open(filename).read()
+    open(filename, "w").write(data[:len(data) * 10 // 11])
+    trace_cache = TraceCache(os.path.join(directory, "cache"))
+
+    print "{0} lines".format(lines)
+    print "  {0:16s} {1:8.2f} sec".format("no cache", read(filename, None))
+    print "  {0:16s} {1:8.2f} sec".format("empty cache", read(filename, trace_cache))
+    print "  {0:16s} {1:8.2f} sec".format("cached", read(filename, trace_cache))
+    open(filename, "w").write(data)
+    print "  {0:16s} {1:8.2f} sec".format("grown 10%", read(filename, trace_cache))
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
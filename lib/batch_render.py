@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# Render a log to PNG/SVG/PDF without GTK:
+#
+#   vizexec.py -o OUTPUT [-r Y0:Y1] [-p PAGE_HEIGHT] [-z ZOOM] [-i] [-v] LOGFILE
+
+import os
+import math
+import optparse
+import cairo
+
+from seqdata import SequenceData
+from logindex import open_index
+from diagnostics import set_verbosity
+
+# Cairo image surfaces can not be larger than 32767 pixels.
+MAX_PNG_HEIGHT = 32000
+
+
+def load_log(filename):
+    seqdata = SequenceData()
+    seqdata.read_file(filename)
+    seqdata.unblock_all()
+    seqdata.sync_ypos()
+    return seqdata
+
+
+def page_ranges(y0, y1, page_height):
+    pages = []
+    while y0 < y1:
+        pages.append((y0, min(y0 + page_height, y1)))
+        y0 += page_height
+    return pages
+
+
+def page_filename(filename, num, count):
+    if count == 1:
+        return filename
+    base, ext = os.path.splitext(filename)
+    return "{0}-{1:03d}{2}".format(base, num + 1, ext)
+
+
+def page_size(y0, y1, zoom):
+    """ Height in pixels of ypos range [y0, y1) at zoom """
+    return int(math.ceil((y1 - y0) * zoom))
+
+
+def draw_page(ctx, seqdata, width, y0, y1, zoom = 1.0):
+    ctx.set_source_rgb(1.0, 1.0, 1.0)
+    ctx.rectangle(0, 0, width, page_size(y0, y1, zoom))
+    ctx.fill()
+    if zoom == 1.0:
+        seqdata.draw(ctx, 0, y0, width, y1 - y0)
+    else:
+        seqdata.draw_overview(ctx, 0, y0, width, y1 - y0, zoom)
+
+
+def render(seqdata, filename, y0 = 0, y1 = None, page_height = None, zoom = 1.0):
+    """ Render ypos range [y0, y1) to filename, returns the written file names """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in (".png", ".svg", ".pdf"):
+        raise ValueError("Unknown output format: " + filename)
+    if y1 is None:
+        y1 = seqdata.get_height()
+    if page_height is None:
+        page_height = MAX_PNG_HEIGHT if ext == ".png" else page_size(y0, y1, zoom)
+    width = seqdata.get_width()
+    # page_height is in pixels, pages in ypos.
+    pages = page_ranges(y0, y1, max(int(page_height / zoom), 1))
+
+    if ext == ".pdf":
+        surface = cairo.PDFSurface(filename, width, page_height)
+        ctx = cairo.Context(surface)
+        for py0, py1 in pages:
+            surface.set_size(width, page_size(py0, py1, zoom))
+            draw_page(ctx, seqdata, width, py0, py1, zoom)
+            ctx.show_page()
+        surface.finish()
+        return [filename]
+
+    written = []
+    for num, (py0, py1) in enumerate(pages):
+        fn = page_filename(filename, num, len(pages))
+        if ext == ".png":
+            surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, page_size(py0, py1, zoom))
+            draw_page(cairo.Context(surface), seqdata, width, py0, py1, zoom)
+            surface.write_to_png(fn)
+        else:
+            surface = cairo.SVGSurface(fn, width, page_size(py0, py1, zoom))
+            draw_page(cairo.Context(surface), seqdata, width, py0, py1, zoom)
+            surface.finish()
+        written.append(fn)
+    return written
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage = "%prog -o OUTPUT [-r Y0:Y1] [-p PAGE_HEIGHT] [-z ZOOM] [-i] [-v] LOGFILE")
+    parser.add_option("-o", dest = "output", help = "output file (.png, .svg or .pdf)")
+    parser.add_option("-r", dest = "range", help = "ypos range to render, as Y0:Y1")
+    parser.add_option("-p", dest = "page_height", type = "int", help = "split the output into pages")
+    parser.add_option("-z", dest = "zoom", type = "float", default = 1.0,
+                      help = "vertical scale, below 1 lanes are drawn as activity summaries")
+    parser.add_option("-i", dest = "index", action = "store_true", default = False,
+                      help = "lay out only the rendered range, using the sidecar index of the log")
+    parser.add_option("-v", dest = "verbosity", action = "count", default = 0,
+                      help = "print diagnostics, twice for every event")
+    opts, args = parser.parse_args(argv)
+    if not opts.output or len(args) != 1:
+        parser.error("an output file and one log file are required")
+    if not 0 < opts.zoom <= 1:
+        parser.error("the zoom must be in (0, 1]")
+    if opts.page_height is not None and opts.page_height <= 0:
+        parser.error("the page height must be positive")
+
+    set_verbosity(opts.verbosity)
+    y0, y1 = 0, None
+    if opts.range:
+        try:
+            start, end = opts.range.split(":")
+            y0 = int(start) if start else 0
+            y1 = int(end) if end else None
+        except ValueError:
+            parser.error("the range must be Y0:Y1")
+        if y1 is not None and y0 >= y1:
+            parser.error("the range {0} is empty".format(opts.range))
+
+    seqdata = open_index(args[0]) if opts.index else load_log(args[0])
+    seqdata.diag.log_summary()
+    # The range is rendered up to the end of the log.
+    height = seqdata.get_height()
+    if not 0 <= y0 < height:
+        parser.error("the range {0} starts outside the log, which ends at {1}".format(opts.range, height))
+    y1 = min(y1, height) if y1 is not None else height
+    written = render(seqdata, opts.output, y0, y1, opts.page_height, opts.zoom)
+    if not written:
+        parser.error("nothing was rendered")
+    for fn in written:
+        print "Wrote", fn
+    return 0
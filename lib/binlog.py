@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Binary log written by VizexecLogWriter with VIZEXEC_LOGFORMAT=binary.
+#
+# The log starts with MAGIC and continues with records of
+#   type (uint8), payload length (uint32), payload
+# in little endian. A string record carries a uint32 id followed by the
+# string; command records refer to function names, message ids and thread
+# ids by these ids, so each string is sent only once.
+
+import mmap
+import struct
+
+MAGIC = "\x89VZB\r\n\x1a\n"
+
+STRING_RECORD = 0
+COMMENT_RECORD = 255
+
+# type: (command, fields), where "I" is a string id and "Q" a number.
+# Must match BINARY_RECORDS in logwriter/python/VizexecLogWriter.py.
+COMMAND_RECORDS = {
+    1: ("CAL", "IQI"),
+    2: ("RET", "IQ"),
+    3: ("PHS", "IQI"),
+    4: ("SND", "IQI"),
+    5: ("RCV", "IQI"),
+    6: ("EVT", "IQI"),
+    7: ("INF", "II"),
+    8: ("TNM", "II"),
+    9: ("TRM", "IQ"),
+}
+
+# Turn the unpacked fields into the tokens of a text log line.
+FIELD_CONVERTERS = {
+    "IQI": lambda name, strings, v: [name, strings[v[0]], str(v[1]), strings[v[2]]],
+    "IQ": lambda name, strings, v: [name, strings[v[0]], str(v[1])],
+    "II": lambda name, strings, v: [name, strings[v[0]], strings[v[1]]],
+}
+
+RECORD_HEADER = struct.Struct("<BI")
+STRING_ID = struct.Struct("<I")
+
+
+def sniff(head):
+    """ True for a binary log, False for a text log, None if head is too short to tell """
+    if head.startswith(MAGIC):
+        return True
+    if MAGIC.startswith(head):
+        return None
+    return False
+
+
+class BinaryDecoder:
+    """ Decodes records into the (cmd, line) pairs of parse_line() """
+    def __init__(self):
+        self.strings = {}
+        self.commands = {}
+        for rtype, (name, fields) in COMMAND_RECORDS.items():
+            self.commands[rtype] = (name, struct.Struct("<" + fields), FIELD_CONVERTERS[fields])
+        self.pending = bytearray()
+
+    def decode(self, buf, pos = 0, limit = None, end = None):
+        """ Decode up to limit complete records of buf[pos:end], returns (batch, next pos) """
+        batch = []
+        end = len(buf) if end is None else min(end, len(buf))
+        strings = self.strings
+        commands = self.commands
+        header_size = RECORD_HEADER.size
+        count = 0
+        while pos + header_size <= end and count != limit:
+            rtype, size = RECORD_HEADER.unpack_from(buf, pos)
+            body = pos + header_size
+            if body + size > end:
+                break
+            pos = body + size
+            count += 1
+            command = commands.get(rtype)
+            if command is not None:
+                name, record, convert = command
+                if size < record.size:
+                    batch.append((None, "<short {0} record>".format(name)))
+                    continue
+                try:
+                    batch.append((convert(name, strings, record.unpack_from(buf, body)), ""))
+                except KeyError:
+                    batch.append((None, "<{0} record with unknown string id>".format(name)))
+            elif rtype == STRING_RECORD:
+                if size < STRING_ID.size:
+                    batch.append((None, "<short string record>"))
+                    continue
+                sid, = STRING_ID.unpack_from(buf, body)
+                strings[sid] = str(buf[body + STRING_ID.size:pos])
+            elif rtype == COMMENT_RECORD:
+                batch.append((["#"], "# " + str(buf[body:pos])))
+            else:
+                batch.append((None, "<unknown record type {0}>".format(rtype)))
+        return batch, pos
+
+    def feed(self, data):
+        """ Decode streamed data following MAGIC, keeping an incomplete record for later """
+        self.pending += data
+        batch, pos = self.decode(self.pending)
+        del self.pending[:pos]
+        return batch
+
+
+def read_batches(f, batch_records = 10000):
+    """ Yield batches decoded in place from the mmap of binary log file f """
+    buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    decoder = BinaryDecoder()
+    pos = len(MAGIC)
+    try:
+        while True:
+            batch, next_pos = decoder.decode(buf, pos, batch_records)
+            if next_pos == pos:
+                break
+            pos = next_pos
+            if batch:
+                yield batch
+    finally:
+        buf.close()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger("vizexec")
+logger.addHandler(logging.NullHandler())
+logger.setLevel(logging.WARNING)
+logger.propagate = False
+
+
+def set_verbosity(verbosity):
+    """ 0: quiet, 1: connections and summaries, 2: every diagnostic event """
+    if verbosity <= 0:
+        logger.setLevel(logging.WARNING)
+        return
+    if not [h for h in logger.handlers if not isinstance(h, logging.NullHandler)]:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO if verbosity == 1 else logging.DEBUG)
+
+
+class Diagnostics:
+    """ Counters of ingest events, optionally logged one by one """
+    def __init__(self):
+        self.counters = {}
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def event(self, name, fmt, *args):
+        """ Count name, and log fmt % args when debug logging is enabled """
+        self.counters[name] = self.counters.get(name, 0) + 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[" + name + "] " + fmt, *args)
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+    def summary(self):
+        if not self.counters:
+            return "No diagnostics recorded."
+        width = max(len(name) for name in self.counters)
+        return "\n".join(
+            "{0:<{1}} {2}".format(name, width, self.counters[name])
+            for name in sorted(self.counters))
+
+    def log_summary(self):
+        if logger.isEnabledFor(logging.INFO):
+            for line in self.summary().split("\n"):
+                logger.info(line)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+SELECTED_BGCOLOR = '#0000FF'
+SELECTED_ALPHA = 0.2
+
+DEFAULT_PARAMS = {
+    'bgcolor': None,
+    'fontname': 'Serif',
+    'fontsize': 10,
+    'fontcolor': '#000000',
+    'textalign': 'center',
+    'linecolor': None,
+    'linewidth': 1.0,
+    'dash': [],
+    'alpha': None,
+    'linealpha': None,
+}
+
+_color_table = {}
+
+def StrToColor(s):
+    """ '#RGB', '#RRGGBB', '#RRRGGGBBB' or '#RRRRGGGGBBBB' to floats """
+    rgb = _color_table.get(s)
+    if rgb is None:
+        digits = len(s) - 1
+        if not s.startswith('#') or digits not in (3, 6, 9, 12):
+            raise ValueError("Invalid color: " + s)
+        n = digits // 3
+        scale = float(16 ** n - 1)
+        rgb = tuple(int(s[1 + i*n:1 + (i+1)*n], 16) / scale for i in range(3))
+        _color_table[s] = rgb
+    return rgb
+
+
+def color_rgba(s, alpha):
+    if s is None:
+        return None
+    return StrToColor(s) + (alpha if alpha is not None else 1.0, )
+
+
+class Style(object):
+    """ Drawing parameters with colors parsed once """
+    def __init__(self, **params):
+        p = dict(DEFAULT_PARAMS)
+        p.update(params)
+        if p['textalign'] not in ("center", "left", "lefttop"):
+            raise ValueError("Unknown textalign: " + p['textalign'])
+        self.params = p
+        self.font = (p['fontname'], p['fontsize'])
+        self.textalign = p['textalign']
+        self.fill_rgba = color_rgba(p['bgcolor'], p['alpha'])
+        self.line_rgba = color_rgba(p['linecolor'], p['linealpha'])
+        self.font_rgba = color_rgba(p['fontcolor'], None)
+        self.linewidth = p['linewidth']
+        self.dash = list(p['dash'])
+        self._selected = None
+
+    def derive(self, **params):
+        p = dict(self.params)
+        p.update(params)
+        return Style(**p)
+
+    def selected(self):
+        """ Style of a selected box """
+        if self._selected is None:
+            self._selected = self.derive(bgcolor = SELECTED_BGCOLOR, alpha = SELECTED_ALPHA)
+        return self._selected
+
+
+SELECTED_LINE_STYLE = Style(
+    linecolor = SELECTED_BGCOLOR,
+    linealpha = SELECTED_ALPHA,
+    linewidth = 8.0,
+)
+
+CALL_LABEL_STYLE = Style(textalign = 'left')
+CALL_BAR_STYLE = Style(linecolor = '#000000', linewidth = 1.0)
+
+MARK_LINE_STYLE = Style(linecolor = '#FF0000', linewidth = 1.0)
+MARK_LABEL_STYLE = Style(textalign = 'left')
+PHASE_LABEL_STYLE = Style(textalign = 'left')
+
+COMM_STYLE = Style(linecolor = '#0000FF', linewidth = 1.0, dash = [6, 2])
+COMM_BACKWARD_STYLE = COMM_STYLE.derive(linecolor = '#FF0000')
+
+LIFELINE_HEADER_STYLE = Style(linecolor = '#000000', bgcolor = '#FFFEDD')
+LIFELINE_FOOTER_STYLE = Style(bgcolor = '#FFFFFF', alpha = 0.8)
+
+# Activity of a lane in zoomed out views, more transparent where it is sparse.
+OVERVIEW_STYLE = Style(bgcolor = '#404040')
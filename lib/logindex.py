@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+
+# Random access to large logs through a sidecar index.
+#
+# One layout pass over the log writes LOG.vzi next to it, holding
+#   - a checkpoint every CHECKPOINT_BYTES of log: the byte offset, the ypos,
+#     the running lifelines with their open frames and blocked commands, the
+#     sends still waiting for their receive and the receives given up waiting
+#     for their send,
+#   - the lane, ypos range and name of every lifeline,
+#   - both ends of every communication,
+#   - the activity summary of every lane, for zoomed out views,
+#   - where every name appears, for searching.
+# WindowedLog lays out only the checkpoint intervals around the view, by
+# resuming from the checkpoint before it.
+#
+# The index is saved with marshal, as plain data behind an INDEX_MAGIC
+# header, so that reading one planted next to a shared log can not run code
+# the way unpickling it could.
+
+import os
+import bisect
+import mmap
+import shutil
+import marshal
+from array import array
+from collections import deque
+
+import binlog
+from seqdata import SequenceData, Lifeline, LaneSummary, SummaryLevel, parse_line
+from seqdata import ENTITY_MAX_HEIGHT, BAR_WIDTH, LANE_WIDTH, LONG_COMM_HEIGHT
+from drawstyle import COMM_STYLE, COMM_BACKWARD_STYLE
+from diagnostics import Diagnostics, logger
+from nameindex import NameIndex
+from parallelparse import parallel_parser
+
+INDEX_MAGIC = "VZI"
+INDEX_VERSION = 5
+INDEX_SUFFIX = ".vzi"
+CHECKPOINT_BYTES = 128 * 1024
+
+
+class LogSource:
+    """ Memory map of a text or binary log, decoded by byte range """
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        st = os.fstat(self.file.fileno())
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        # Empty files can not be mapped.
+        self.buf = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ) if self.size else ""
+        self.binary = bool(binlog.sniff(self.buf[:len(binlog.MAGIC)]))
+        self.start = len(binlog.MAGIC) if self.binary else 0
+        self.decoder = binlog.BinaryDecoder()
+
+    def close(self):
+        if self.size:
+            self.buf.close()
+        self.file.close()
+
+    def read(self, pos, end):
+        """ (cmd, line) pairs of the records in [pos, end) """
+        if self.binary:
+            return self.decoder.decode(self.buf, pos, end = end)[0]
+        lines = self.buf[pos:end].split("\n")
+        if not lines[-1]:
+            lines.pop()
+        return [(parse_line(line), line) for line in lines]
+
+    def read_chunk(self, pos, size):
+        """ Records in about size bytes from pos, returns (batch, next pos) """
+        if self.binary:
+            batch, end = self.decoder.decode(self.buf, pos, end = pos + size)
+            if end == pos:
+                batch, end = self.decoder.decode(self.buf, pos, limit = 1)
+            return batch, end
+        end = self.line_end(pos, size)
+        return self.read(pos, end), end
+
+    def line_end(self, pos, size):
+        """ Offset following the line that ends about size bytes from pos """
+        newline = self.buf.find("\n", min(pos + size, self.size) - 1)
+        return newline + 1 if newline >= 0 else self.size
+
+    def chunks(self, size, parser = None):
+        """ Yield (end, batch) of the chunks of about size bytes, from the start of the log """
+        pos = self.start
+        if parser is None or self.binary:
+            while pos < self.size:
+                batch, pos = self.read_chunk(pos, size)
+                yield pos, batch
+            return
+        for end, batch in parser.parse(self.text_chunks(pos, size)):
+            yield end, batch
+
+    def text_chunks(self, pos, size):
+        """ (end, text of the lines) of the chunks read_chunk() reads from pos """
+        while pos < self.size:
+            end = self.line_end(pos, size)
+            text = self.buf[pos:end]
+            yield end, text[:-1] if text.endswith("\n") else text
+            pos = end
+
+
+class EndedLifeline(object):
+    """ Lifeline terminated before a checkpoint, kept to skip its later lines """
+    __slots__ = ("lifeline_id", "start_ypos")
+    terminated = True
+    blocking = False
+
+    def __init__(self, lifeline_id, start_ypos):
+        self.lifeline_id = lifeline_id
+        self.start_ypos = start_ypos
+
+    def get_id(self):
+        return self.lifeline_id
+
+    def unblock(self):
+        pass
+
+
+def take_checkpoint(model, offset):
+    """ (offset, ypos, running lifelines, unmatched sends and receives) to resume model from """
+    live = []
+    for llid, lifeline in model.lifelines.iteritems():
+        if lifeline.terminated:
+            continue
+        frames = []
+        stk = lifeline.current_stack
+        while stk is not None:
+            frames.append((stk.func_name, lifeline.events.ypos[stk.call_index]))
+            stk = stk.parent
+        frames.reverse()
+        live.append((llid, lifeline.lane, lifeline.start_ypos, lifeline.lifeline_name,
+                     frames, lifeline.blocked_ypos, list(lifeline.blocked_cmds)))
+    sends = [(comm_id, ) + send_point(comm) for comm_id, comm in model.open_sending.iteritems()]
+    recvs = [(comm_id, ) + recv_point(comm) for comm_id, comm in model.open_receiving.iteritems()]
+    waiting = [(comm_id, [lifeline.get_id() for lifeline in lifelines])
+               for comm_id, lifelines in model.waiting_receivers.iteritems()]
+    return (offset, model.current_ypos, live, sends, recvs, waiting)
+
+
+def resume(checkpoint, ended, diag):
+    """ New SequenceData in the state saved by take_checkpoint() """
+    offset, ypos, live, sends, recvs, waiting = checkpoint
+    model = SequenceData()
+    model.diag = diag
+    model.current_ypos = ypos
+    model.lifelines.update(ended)
+    for llid, lane, start_ypos, name, frames, blocked_ypos, blocked_cmds in live:
+        lifeline = model.restore_lifeline(llid, lane, start_ypos)
+        lifeline.lifeline_name = name
+        for func_name, call_ypos in frames:
+            lifeline.restore_call(func_name, call_ypos)
+        lifeline.blocking = bool(blocked_cmds)
+        lifeline.blocked_ypos = blocked_ypos
+        lifeline.blocked_cmds = deque(blocked_cmds)
+    for comm_id, llids in waiting:
+        model.waiting_receivers[comm_id] = deque(model.lifelines[llid] for llid in llids)
+    # Ends before the checkpoint are only needed to match the other end.
+    for comm_id, x, y in sends:
+        comm = model.new_communication(comm_id)
+        comm.send_point = (x, y)
+        model.open_sending[comm_id] = comm
+    for comm_id, x, y in recvs:
+        comm = model.new_communication(comm_id)
+        comm.recv_point = (x, y)
+        model.open_receiving[comm_id] = comm
+    return model
+
+
+def send_point(comm):
+    if comm.send_entity is None:
+        return getattr(comm, "send_point", None)
+    return entity_point(comm.send_entity)
+
+
+def recv_point(comm):
+    if comm.recv_entity is None:
+        return getattr(comm, "recv_point", None)
+    return entity_point(comm.recv_entity)
+
+
+def entity_point(entity):
+    return (entity.lifeline.bar_xpos(entity.stack, "c") + 2, entity.ypos)
+
+
+class LogIndex:
+    """ Checkpoints, lifelines and communications of one log file """
+    def __init__(self):
+        self.version = INDEX_VERSION
+        self.size = 0
+        self.mtime = 0
+        self.binary = False
+        self.strings = {}
+        self.checkpoints = []
+        self.checkpoint_ypos = []
+        self.lifelines = []
+        self.height = 0
+        self.max_lane = 0
+        self.max_depth = 0
+        self.counters = {}
+        # Both ends of communications up to LONG_COMM_HEIGHT tall, sorted by the upper end.
+        self.comm_tops = array('l')
+        self.comm_points = array('l')
+        self.long_comms = []
+        self.lane_summaries = []
+        self.names = NameIndex()
+
+    def build(self, source, checkpoint_bytes = CHECKPOINT_BYTES, processes = None):
+        """ Lay out the whole log, keeping only one checkpoint interval in memory """
+        self.size = source.size
+        self.mtime = source.mtime
+        self.binary = source.binary
+        diag = Diagnostics()
+        ended = {}
+        comms = []
+        checkpoint = (source.start, 50, [], [], [], [])
+        model = resume(checkpoint, ended, diag)
+        self.checkpoints.append(checkpoint)
+        parser = None if source.binary else parallel_parser(source.size, processes)
+        try:
+            for pos, batch in source.chunks(checkpoint_bytes, parser):
+                model.add_data_cmds(batch)
+                self.collect(model, ended, comms)
+                checkpoint = take_checkpoint(model, pos)
+                self.checkpoints.append(checkpoint)
+                model = resume(checkpoint, ended, diag)
+        finally:
+            if parser is not None:
+                parser.close()
+        model.unblock_all()
+        model.sync_ypos()
+        self.collect(model, ended, comms)
+        for llid, lifeline in model.lifelines.iteritems():
+            if isinstance(lifeline, Lifeline) and not lifeline.terminated:
+                self.lifelines.append((llid, lifeline.lane, lifeline.start_ypos, None, lifeline.lifeline_name))
+        self.height = model.current_ypos
+        self.strings = source.decoder.strings
+        self.counters = diag.counters
+        self.index_comms(comms)
+        self.checkpoint_ypos = [checkpoint[1] for checkpoint in self.checkpoints]
+
+    def collect(self, model, ended, comms):
+        """ Move what is final in model out of it, before a checkpoint """
+        self.max_lane = max(self.max_lane, model.max_lane)
+        self.max_depth = max(self.max_depth, model.max_depth)
+        for lane in range(len(model.lane_summaries)):
+            while len(self.lane_summaries) <= lane:
+                self.lane_summaries.append(LaneSummary())
+            self.lane_summaries[lane].merge(model.lane_summary(lane))
+        self.names.merge(model.names())
+        for llid, lifeline in model.lifelines.iteritems():
+            if isinstance(lifeline, Lifeline) and lifeline.terminated:
+                self.lifelines.append((llid, lifeline.lane, lifeline.start_ypos, lifeline.end_ypos, lifeline.lifeline_name))
+                ended[llid] = EndedLifeline(llid, lifeline.start_ypos)
+        for comm in model.comms:
+            src = send_point(comm)
+            dst = recv_point(comm)
+            if src is not None and dst is not None:
+                comms.append(src + dst)
+
+    def index_comms(self, comms):
+        short = []
+        for comm in comms:
+            top, bottom = sorted((comm[1], comm[3]))
+            if bottom - top > LONG_COMM_HEIGHT:
+                self.long_comms.append(comm)
+            else:
+                short.append((top, comm))
+        short.sort()
+        for top, comm in short:
+            self.comm_tops.append(top)
+            self.comm_points.extend(comm)
+
+    def comms_in_range(self, y0, y1):
+        """ (send x, send y, recv x, recv y) of communications crossing [y0, y1] """
+        result = []
+        points = self.comm_points
+        i = bisect.bisect_left(self.comm_tops, y0 - LONG_COMM_HEIGHT)
+        stop = bisect.bisect_right(self.comm_tops, y1)
+        while i < stop:
+            comm = tuple(points[i * 4:i * 4 + 4])
+            if max(comm[1], comm[3]) >= y0:
+                result.append(comm)
+            i += 1
+        for comm in self.long_comms:
+            if max(comm[1], comm[3]) >= y0 and min(comm[1], comm[3]) <= y1:
+                result.append(comm)
+        return result
+
+    def ended_lifelines(self, ypos):
+        """ Lifelines terminated before the checkpoint at ypos """
+        ended = {}
+        for llid, lane, start_ypos, end_ypos, name in self.lifelines:
+            if end_ypos is not None and end_ypos <= ypos:
+                ended[llid] = EndedLifeline(llid, start_ypos)
+        return ended
+
+    def save(self, filename):
+        state = self.__dict__.copy()
+        state["comm_tops"] = self.comm_tops.tostring()
+        state["comm_points"] = self.comm_points.tostring()
+        state["lane_summaries"] = [summary_state(summary) for summary in self.lane_summaries]
+        state["names"] = dict((name, (ys.tostring(), lanes.tostring()))
+                              for name, (ys, lanes) in self.names.postings.iteritems())
+        # Written aside and renamed, so a reader never sees a partial index.
+        tmpname = filename + ".tmp"
+        f = open(tmpname, 'wb')
+        try:
+            marshal.dump((INDEX_MAGIC, INDEX_VERSION), f, 2)
+            marshal.dump(state, f, 2)
+        finally:
+            f.close()
+        os.rename(tmpname, filename)
+
+    def load(self, filename, source):
+        """ Read the index saved for source, False if it is missing, stale or malformed """
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            return False
+        try:
+            try:
+                if marshal.load(f) != (INDEX_MAGIC, INDEX_VERSION):
+                    return False
+                state = marshal.load(f)
+            finally:
+                f.close()
+            if type(state) is not dict or set(state) != set(self.__dict__):
+                return False
+            if (state["size"] != source.size or state["mtime"] != source.mtime
+                    or state["binary"] != source.binary):
+                return False
+            state["comm_tops"] = array('l', state["comm_tops"])
+            state["comm_points"] = array('l', state["comm_points"])
+            state["lane_summaries"] = [summary_from_state(summary) for summary in state["lane_summaries"]]
+            names = NameIndex()
+            for name, (ys, lanes) in state["names"].iteritems():
+                names.postings[name] = (array('l', ys), array('l', lanes))
+            state["names"] = names
+        except (IOError, EOFError, ValueError, TypeError, AttributeError) as e:
+            logger.warning("Ignoring index %s: %s", filename, e)
+            return False
+        self.__dict__.update(state)
+        return True
+
+
+def summary_state(summary):
+    levels = [(level.buckets.tostring(), level.counts.tostring(), level.depths.tostring(), level.stale_from)
+              for level in summary.levels]
+    return (summary.dirty_from, levels)
+
+
+def summary_from_state(state):
+    dirty_from, levels = state
+    summary = LaneSummary()
+    summary.dirty_from = dirty_from
+    summary.levels = []
+    for buckets, counts, depths, stale_from in levels:
+        level = SummaryLevel()
+        level.buckets = array('l', buckets)
+        level.counts = array('l', counts)
+        level.depths = array('i', depths)
+        level.stale_from = stale_from
+        summary.levels.append(level)
+    if not summary.levels:
+        raise ValueError("lane summary without levels")
+    return summary
+
+
+def open_index(filename, checkpoint_bytes = CHECKPOINT_BYTES, processes = None):
+    """ WindowedLog of filename, building and saving its index if needed """
+    source = LogSource(filename)
+    index = LogIndex()
+    index_filename = filename + INDEX_SUFFIX
+    if index.load(index_filename, source):
+        source.decoder.strings = index.strings
+    else:
+        logger.info("Building index %s", index_filename)
+        index.build(source, checkpoint_bytes, processes)
+        try:
+            index.save(index_filename)
+        except (IOError, OSError) as e:
+            logger.warning("Can not save index %s: %s", index_filename, e)
+    return WindowedLog(source, index)
+
+
+class WindowedLog:
+    """ SequenceData of a log, laid out from checkpoints only where it is viewed """
+    # Laid out ranges kept for redrawing.
+    CachedModels = 4
+
+    def __init__(self, source, index):
+        self.source = source
+        self.index = index
+        self.models = []
+        self.selected_object = None
+        self.names = dict((llid, name) for llid, lane, start_ypos, end_ypos, name in index.lifelines)
+        self.diag = Diagnostics()
+        self.diag.counters.update(index.counters)
+
+    def model_for(self, y0, y1):
+        """ Laid out model drawing [y0, y1] as a full load of the log would """
+        for model in self.models:
+            if model.window_start <= y0 - ENTITY_MAX_HEIGHT and y1 < model.window_end:
+                self.models.remove(model)
+                self.models.insert(0, model)
+                return model
+        ylist = self.index.checkpoint_ypos
+        first = max(bisect.bisect_right(ylist, y0 - ENTITY_MAX_HEIGHT) - 1, 0)
+        # One more interval below the view is laid out for scrolling.
+        last = bisect.bisect_right(ylist, y1) + 1
+        model = self.materialize(first, last)
+        self.models.insert(0, model)
+        del self.models[self.CachedModels:]
+        return model
+
+    def materialize(self, first, last):
+        checkpoint = self.index.checkpoints[first]
+        model = resume(checkpoint, self.index.ended_lifelines(checkpoint[1]), Diagnostics())
+        end = self.index.checkpoints[last][0] if last < len(self.index.checkpoints) else self.source.size
+        model.add_data_cmds(self.source.read(checkpoint[0], end))
+        model.window_start = checkpoint[1] if first > 0 else float("-inf")
+        if end >= self.source.size:
+            model.unblock_all()
+            model.sync_ypos()
+            model.window_end = float("inf")
+        else:
+            model.window_end = model.current_ypos
+        # Names set after the window, as the full layout shows them.
+        for llid, lifeline in model.lifelines.iteritems():
+            if llid in self.names and isinstance(lifeline, Lifeline):
+                lifeline.lifeline_name = self.names[llid]
+        model.max_lane = self.index.max_lane
+        model.max_depth = self.index.max_depth
+        return model
+
+    def model_comm(self, model, comm):
+        """ Whether model has both ends of comm and draws it """
+        return (model.window_start <= comm[1] < model.window_end
+                and model.window_start <= comm[3] < model.window_end)
+
+    def draw(self, ctx, offset_x, offset_y, w, h):
+        self.draw_content(ctx, offset_x, offset_y, w, h)
+        self.draw_overlay(ctx, offset_x, offset_y, w, h)
+
+    def draw_overlay(self, ctx, offset_x, offset_y, w, h):
+        model = self.model_for(offset_y, offset_y + h)
+        model.selected_object = self.selected_object
+        model.draw_overlay(ctx, offset_x, offset_y, w, h)
+
+    def draw_content(self, ctx, offset_x, offset_y, w, h):
+        model = self.model_for(offset_y, offset_y + h)
+        model.selected_object = self.selected_object
+        model.draw_content(ctx, offset_x, offset_y, w, h)
+
+        # Communications with an end outside the model are drawn from the index.
+        x0 = offset_x - 50
+        for comm in self.index.comms_in_range(offset_y, offset_y + h):
+            if self.model_comm(model, comm):
+                continue
+            if max(comm[0], comm[2]) < x0 or min(comm[0], comm[2]) > x0 + w:
+                continue
+            style = COMM_STYLE if comm[1] < comm[3] else COMM_BACKWARD_STYLE
+            ctx.move_to(comm[0] - x0, comm[1] - offset_y)
+            ctx.line_to(comm[2] - x0, comm[3] - offset_y)
+            ctx.set_source_rgba(*style.line_rgba)
+            ctx.set_line_width(style.linewidth)
+            ctx.set_dash(style.dash, 0)
+            ctx.stroke()
+
+    def draw_overview(self, ctx, offset_x, offset_y, w, h, zoom):
+        # Drawn from the summaries of the whole log, see SequenceData.draw_overview().
+        summaries = self.index.lane_summaries
+        lane_lo = max(int((offset_x - 180 - BAR_WIDTH * self.index.max_depth) // LANE_WIDTH), 0)
+        lane_hi = min(int((offset_x + w - 35) // LANE_WIDTH), len(summaries) - 1)
+        for lane in range(lane_lo, lane_hi + 1):
+            summaries[lane].draw(ctx, lane * LANE_WIDTH + 20 - (offset_x - 50), offset_y, h, zoom)
+
+    def find_name(self, text, ypos, lane, backward = False):
+        return self.index.names.find(text, ypos, lane, backward)
+
+    def entity_at(self, lane, ypos):
+        return self.model_for(ypos, ypos).entity_at(lane, ypos)
+
+    def hit_test(self, offset_x, offset_y, w, h, px, py):
+        model = self.model_for(offset_y, offset_y + h)
+        return model.hit_test(offset_x, offset_y, w, h, px, py)
+
+    def take_dirty_regions(self):
+        return []
+
+    def lane_extent(self, lane):
+        # See SequenceData.lane_extent().
+        return (lane * LANE_WIDTH + 35, lane * LANE_WIDTH + 180 + BAR_WIDTH * self.index.max_depth)
+
+    def unblock_all(self):
+        pass
+
+    def sync_ypos(self):
+        pass
+
+    def save_log_to(self, fn):
+        shutil.copyfile(self.source.filename, fn)
+
+    def get_width(self):
+        return self.index.max_lane * LANE_WIDTH + 300
+
+    def get_height(self):
+        return self.index.height + 10
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+# Tokenizer for VizEXEC log records.
+#
+#   <CMD> <thread id> <counter> [<argument>]
+#
+# where CMD is one of CAL/RET/SND/RCV/EVT/PHS/TNM/INF/TRM (or '#' for
+# comments). Arguments are written quoted by the log writers, e.g.
+#
+#   CAL 140213 "12" "main"
+#
+# split_line() returns exactly what shlex.split() returns for the same line,
+# but avoids the shlex state machine for all lines the writers produce.
+
+import re
+import shlex
+
+# Characters that need more than plain whitespace splitting.
+_SPECIAL_CHARS = re.compile(r'["\'\\\x0b\x0c]')
+
+# Characters only the slow path can handle.
+_ESCAPE_CHARS = re.compile(r'[\'\\\x0b\x0c]')
+
+# One word made of unquoted runs and "double quoted" runs.
+_DQUOTED_WORD = re.compile(r'(?:[^\s"]+|"[^"]*")+')
+
+
+def split_line(line):
+    """ Split a log line into tokens, same as shlex.split(line) """
+    if not _SPECIAL_CHARS.search(line):
+        return line.split()
+
+    if not _ESCAPE_CHARS.search(line):
+        if line.count('"') % 2:
+            raise ValueError("No closing quotation")
+        return [w.replace('"', '') for w in _DQUOTED_WORD.findall(line)]
+
+    return shlex.split(line)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Inverted index from function, event, phase and message names to where
+# they appear, for searching a log by name.
+#
+# The postings of a name are two arrays sorted by (ypos, lane). A lane and
+# a ypos identify one entity, as lifelines sharing a lane never overlap.
+
+import bisect
+from array import array
+
+
+class NameIndex:
+    def __init__(self):
+        # name: (ypos array, lane array)
+        self.postings = {}
+        self.query = None
+        self.query_names = []
+        self.query_size = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["postings"] = dict((name, (ys.tostring(), lanes.tostring()))
+                                 for name, (ys, lanes) in self.postings.iteritems())
+        state["query"] = None
+        state["query_names"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.postings = dict((name, (array('l', ys), array('l', lanes)))
+                             for name, (ys, lanes) in self.postings.iteritems())
+
+    def __len__(self):
+        return len(self.postings)
+
+    def add(self, name, lane, ypos):
+        posting = self.postings.get(name)
+        if posting is None:
+            self.postings[name] = (array('l', [ypos]), array('l', [lane]))
+            return
+        ys, lanes = posting
+        if ypos > ys[-1] or (ypos == ys[-1] and lane >= lanes[-1]):
+            ys.append(ypos)
+            lanes.append(lane)
+            return
+        i = bisect.bisect_left(ys, ypos)
+        while i < len(ys) and ys[i] == ypos and lanes[i] < lane:
+            i += 1
+        ys.insert(i, ypos)
+        lanes.insert(i, lane)
+
+    def drop(self, lane, ypos):
+        """ Remove the postings of the lane from ypos on """
+        for name, (ys, lanes) in self.postings.items():
+            i = bisect.bisect_left(ys, ypos)
+            if lane not in lanes[i:]:
+                continue
+            kept = [(y, l) for y, l in zip(ys[i:], lanes[i:]) if l != lane]
+            del ys[i:]
+            del lanes[i:]
+            ys.extend(y for y, l in kept)
+            lanes.extend(l for y, l in kept)
+            if not ys:
+                del self.postings[name]
+                self.query = None
+
+    def merge(self, other):
+        """ Add the postings of other """
+        for name, (ys, lanes) in other.postings.iteritems():
+            for ypos, lane in zip(ys, lanes):
+                self.add(name, lane, ypos)
+
+    def names_matching(self, text):
+        """ Names containing text """
+        # The names are scanned again only when the query or the set of names changed.
+        if text != self.query or len(self.postings) != self.query_size:
+            self.query = text
+            self.query_names = [name for name in self.postings if text in name]
+            self.query_size = len(self.postings)
+        return self.query_names
+
+    def find(self, text, ypos, lane, backward = False):
+        """ (ypos, lane) of the next entity named with text after (ypos, lane), or None """
+        best = None
+        for name in self.names_matching(text):
+            ys, lanes = self.postings[name]
+            if backward:
+                i = bisect.bisect_right(ys, ypos) - 1
+                while i >= 0 and ys[i] == ypos and lanes[i] >= lane:
+                    i -= 1
+                if i >= 0 and (best is None or (ys[i], lanes[i]) > best):
+                    best = (ys[i], lanes[i])
+            else:
+                i = bisect.bisect_left(ys, ypos)
+                while i < len(ys) and ys[i] == ypos and lanes[i] <= lane:
+                    i += 1
+                if i < len(ys) and (best is None or (ys[i], lanes[i]) < best):
+                    best = (ys[i], lanes[i])
+        return best
+
+    def count(self, text):
+        """ Number of entities named with text """
+        return sum(len(self.postings[name][0]) for name in self.names_matching(text))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# Tokenizing large text logs in a pool of processes.
+#
+# Chunks of complete lines are handed to the workers, which return the
+# tokens of each line joined by NUL, one line per line. Splitting these is
+# much cheaper than parse_line() and than unpickling the tokens, so the
+# process reading the log only decodes the chunks, in file order, and lays
+# them out as if it had parsed them itself. Lines the encoding can not
+# carry, like comments and invalid lines, come back as they were, marked
+# with SOH, and are parsed again when decoded.
+
+import os
+import multiprocessing
+from collections import deque
+
+from seqdata import parse_line
+
+# Smaller logs are parsed in the reading process.
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+RAW_MARK = "\1"
+
+
+def default_processes():
+    """ VIZEXEC_PARSE_PROCESSES worker processes, by default one per core """
+    processes = os.environ.get("VIZEXEC_PARSE_PROCESSES")
+    if processes:
+        return int(processes)
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def encode_lines(text):
+    """ Tokens of the lines of text joined by NUL, run by the workers """
+    records = []
+    for line in text.split("\n"):
+        cmd = parse_line(line)
+        # Only lines SequenceData.add_data_cmd() lays out without looking at them.
+        if (cmd and len(cmd) >= 2 and cmd[0] != "#" and cmd[1] not in ("", "-")
+                and "\0" not in line and not cmd[0].startswith(RAW_MARK)):
+            records.append("\0".join(cmd))
+        else:
+            records.append(RAW_MARK + line)
+    return "\n".join(records)
+
+
+def decode_lines(data):
+    """ (cmd, line) pairs of parse_line() from the result of encode_lines() """
+    batch = []
+    for record in data.split("\n"):
+        if record[:1] == RAW_MARK:
+            line = record[1:]
+            batch.append((parse_line(line), line))
+        else:
+            batch.append((record.split("\0"), ""))
+    return batch
+
+
+class LineChunks:
+    """ Text of the complete lines in the data returned by read(), until it returns nothing """
+    def __init__(self, read, data = ""):
+        self.read = read
+        self.data = data
+        # The incomplete last line, once iterated over.
+        self.rest = ""
+
+    def __iter__(self):
+        data = self.data
+        while data:
+            data = self.rest + data
+            end = data.rfind("\n")
+            if end >= 0:
+                self.rest = data[end + 1:]
+                yield data[:end]
+            else:
+                self.rest = data
+            data = self.read()
+
+
+class ParallelParser:
+    def __init__(self, processes):
+        self.processes = processes
+        self.pool = multiprocessing.Pool(processes)
+        # Chunks handed out ahead of the one being laid out.
+        self.ahead = processes * 2
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def parse(self, chunks):
+        """ Yield (key, (cmd, line) batch) for the (key, text) chunks, in order """
+        pending = deque()
+        for key, text in chunks:
+            pending.append((key, self.pool.apply_async(encode_lines, (text, ))))
+            if len(pending) >= self.ahead:
+                key, result = pending.popleft()
+                yield key, decode_lines(result.get())
+        while pending:
+            key, result = pending.popleft()
+            yield key, decode_lines(result.get())
+
+
+def parallel_parser(size, processes = None):
+    """ ParallelParser for size bytes of text log, or None if not worth it """
+    if processes is None:
+        processes = default_processes()
+    if processes < 2 or size < PARALLEL_MIN_BYTES:
+        return None
+    return ParallelParser(processes)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Lines of a log as SequenceData read them, kept for saving the log again.
+#
+# Only the last lines are held in memory. Every window lines they are
+# appended to an anonymous spill file, which then holds the log itself, or
+# if asked a zlib compressed block per window, each after its length.
+
+import os
+import zlib
+import struct
+import shutil
+import tempfile
+
+BLOCK_HEADER = struct.Struct("<I")
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def default_window():
+    """ VIZEXEC_RAWLOG_WINDOW lines held in memory before spilling """
+    return int(os.environ.get("VIZEXEC_RAWLOG_WINDOW", "10000"))
+
+
+def default_compress():
+    """ VIZEXEC_RAWLOG_COMPRESS=1 compresses the spill file """
+    return os.environ.get("VIZEXEC_RAWLOG_COMPRESS", "0") not in ("", "0")
+
+
+class RawLog:
+    def __init__(self, window = None, compress = None):
+        self.window = max(window if window is not None else default_window(), 1)
+        self.compress = compress if compress is not None else default_compress()
+        self.lines = []
+        self.spill = None
+        self.spilled = 0
+
+    def __len__(self):
+        return self.spilled + len(self.lines)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["spill"] = self.read_spill()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        data = self.spill
+        self.spill = None
+        if data:
+            self.open_spill().write(data)
+
+    def append(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.window:
+            self.flush()
+
+    def flush(self):
+        """ Move the lines held in memory to the spill file """
+        if not self.lines:
+            return
+        data = "\n".join(self.lines) + "\n"
+        f = self.open_spill()
+        if self.compress:
+            data = zlib.compress(data, 1)
+            f.write(BLOCK_HEADER.pack(len(data)))
+        f.write(data)
+        self.spilled += len(self.lines)
+        self.lines = []
+
+    def open_spill(self):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(prefix = "vizexec-rawlog-")
+        self.spill.seek(0, os.SEEK_END)
+        return self.spill
+
+    def read_spill(self):
+        if self.spill is None:
+            return ""
+        self.spill.flush()
+        self.spill.seek(0)
+        return self.spill.read()
+
+    def write_to(self, f):
+        """ Write every line to the file object f """
+        if self.spill is not None:
+            self.spill.flush()
+            self.spill.seek(0)
+            if self.compress:
+                self.copy_blocks(f)
+            else:
+                shutil.copyfileobj(self.spill, f, COPY_CHUNK_SIZE)
+        if self.lines:
+            f.write("\n".join(self.lines) + "\n")
+
+    def copy_blocks(self, f):
+        while True:
+            header = self.spill.read(BLOCK_HEADER.size)
+            if not header:
+                break
+            size, = BLOCK_HEADER.unpack(header)
+            f.write(zlib.decompress(self.spill.read(size)))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+# Redraws requested by the threads reading logs, coalesced into frames.
+#
+# A request made while no frame is pending schedules one, no sooner than
+# one frame interval after the last frame. Requests made until it is drawn
+# are drawn by it, and nothing is scheduled while nothing changes.
+
+import time
+import threading
+
+
+class RedrawScheduler:
+    def __init__(self, draw_frame, timeout_add, max_fps = 30):
+        # timeout_add(msec, callback) calls back on the thread that draws,
+        # like gobject.timeout_add().
+        self.draw_frame = draw_frame
+        self.timeout_add = timeout_add
+        self.interval = 1.0 / max_fps
+        self.lock = threading.Lock()
+        self.pending = False
+        self.last_frame = 0.0
+
+    def request(self):
+        """ Draw a frame soon, callable from any thread """
+        with self.lock:
+            if self.pending:
+                return
+            self.pending = True
+            delay = self.last_frame + self.interval - time.time()
+        self.timeout_add(max(int(delay * 1000), 0), self.frame)
+
+    def frame(self):
+        # Cleared first, so that changes made while drawing get a frame of their own.
+        with self.lock:
+            self.pending = False
+            self.last_frame = time.time()
+        self.draw_frame()
+        return False
@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 
+import sys
 import bisect
-import shlex
-import gtk
-import gtk.glade
+import heapq
+from array import array
+from collections import deque
 import cairo
-import traceback
 from subprocess import list2cmdline
+from logtokenizer import split_line
+from diagnostics import Diagnostics, logger
+import binlog
+from rawlog import RawLog
+from nameindex import NameIndex
+from drawstyle import *
 
-def StrToColor(s):
-    col = gtk.gdk.Color(s)
-    return (col.red / 65535.0, col.green / 65535.0, col.blue / 65535.0)
+def parse_line(line):
+    """ Tokens of a log line, or None if it can not be split """
+    try:
+        return split_line(line.strip())
+    except ValueError:
+        return None
 
 
 def len_point_to_line2(px, py, x0, y0, x1, y1):
@@ -28,32 +37,338 @@ def len_point_to_line2(px, py, x0, y0, x1, y1):
     return (x-px)*(x-px) + (y-py)*(y-py)
 
 
-class YPosComparable:
-    def __init__(self, ypos):
-        self.ypos = ypos
+def in_box(px, py, x0, y0, xs, ys):
+    return x0 < px and y0 < py and px < x0+xs and py < y0+ys
 
-    def __lt__(self, other):
-        return self.ypos < other.ypos
-        
-    def __le__(self, other):
-        return self.ypos <= other.ypos
+
+EVENT_TYPES = (
+    "lifeline_start",
+    "call",
+    "return",
+    "phase",
+    "send",
+    "recv",
+    "event",
+    "terminate",
+)
+EVENT_CODES = dict((name, code) for code, name in enumerate(EVENT_TYPES))
+
+
+class StringTable:
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def intern(self, s):
+        idx = self.index.get(s)
+        if idx is None:
+            idx = len(self.strings)
+            self.strings.append(s)
+            self.index[s] = idx
+        return idx
+
+    def get(self, idx):
+        if idx < 0:
+            return ""
+        return self.strings[idx]
+
+
+class ShiftTree:
+    """ Fenwick tree of ypos deltas applied to ranges of event indices """
+    def __init__(self):
+        self.tree = array('l', [0])
+        self.diff = array('l')
+
+    def grow(self, size):
+        capacity = max(size, len(self.diff) * 2, 1024)
+        self.diff.extend([0] * (capacity - len(self.diff)))
+        tree = array('l', [0]) + self.diff
+        for i in range(1, capacity + 1):
+            j = i + (i & -i)
+            if j <= capacity:
+                tree[j] += tree[i]
+        self.tree = tree
+
+    def add(self, idx, delta):
+        if idx >= len(self.diff):
+            self.grow(idx + 1)
+        self.diff[idx] += delta
+        tree = self.tree
+        size = len(tree)
+        i = idx + 1
+        while i < size:
+            tree[i] += delta
+            i += i & -i
+
+    def add_range(self, start, stop, delta):
+        self.add(start, delta)
+        self.add(stop, -delta)
+
+    def offset(self, idx):
+        # Every range ends before len(diff), so later indices are unshifted.
+        if idx >= len(self.diff):
+            return 0
+        tree = self.tree
+        total = 0
+        i = idx + 1
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+
+class ShiftedYPos:
+    """ Sequence of event ypos with shifts applied, usable with bisect """
+    def __init__(self, raw_ypos, shifts):
+        self.raw_ypos = raw_ypos
+        self.shifts = shifts
+
+    def __len__(self):
+        return len(self.raw_ypos)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self.raw_ypos)
+        return self.raw_ypos[idx] + self.shifts.offset(idx)
+
+
+EVENT_COLUMNS = (("types", 'B'), ("raw_ypos", 'l'), ("depth", 'i'), ("names", 'i'), ("comms", 'i'))
+
+class EventStore:
+    """ Column arrays holding the events of one lifeline """
+    def __init__(self):
+        self.types = array('B')
+        self.raw_ypos = array('l')
+        self.ypos = self.raw_ypos
+        self.shifts = None
+        self.depth = array('i')
+        self.names = array('i')
+        self.comms = array('i')
+        self.stacks = []
+        self.info = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getstate__(self):
+        # Stack frames are saved by Lifeline.__getstate__().
+        state = self.__dict__.copy()
+        del state["stacks"]
+        del state["ypos"]
+        for name, typecode in EVENT_COLUMNS:
+            state[name] = state[name].tostring()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name, typecode in EVENT_COLUMNS:
+            setattr(self, name, array(typecode, state[name]))
+        self.ypos = ShiftedYPos(self.raw_ypos, self.shifts) if self.shifts is not None else self.raw_ypos
+        self.stacks = []
+
+    def append(self, event_type, ypos, stack, name_idx, comm_idx):
+        self.types.append(EVENT_CODES[event_type])
+        self.raw_ypos.append(ypos)
+        self.depth.append(stack.depth if stack is not None else 0)
+        self.names.append(name_idx)
+        self.comms.append(comm_idx)
+        self.stacks.append(stack)
+        return len(self.types) - 1
+
+    def shift_from(self, idx, delta):
+        if idx >= len(self.types) or delta == 0:
+            return
+        if self.shifts is None:
+            self.shifts = ShiftTree()
+            self.ypos = ShiftedYPos(self.raw_ypos, self.shifts)
+        self.shifts.add_range(idx, len(self.types), delta)
+
+
+# Zoomed out views draw per lane summaries instead of events. Level 0 of a
+# summary counts the events in every LOD_BUCKET_HEIGHT of ypos and keeps
+# their deepest stack, level k merges 2 ** LOD_LEVEL_SHIFT buckets of level
+# k - 1. Only buckets holding events are stored.
+LOD_BUCKET_HEIGHT = 64
+LOD_LEVEL_SHIFT = 2
+# Buckets are drawn at least this many pixels tall.
+LOD_MIN_PIXELS = 3
+# Events a bucket of a busy lane holds per ypos.
+LOD_FULL_DENSITY = 1.0 / 20
+
+SUMMARY_COLUMNS = (("buckets", 'l'), ("counts", 'l'), ("depths", 'i'))
+
+class SummaryLevel:
+    """ Event count and deepest stack of the non-empty buckets of one level """
+    def __init__(self):
+        self.buckets = array('l')
+        self.counts = array('l')
+        self.depths = array('i')
+        # Level 0 bucket from which this level is out of date.
+        self.stale_from = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name, typecode in SUMMARY_COLUMNS:
+            state[name] = state[name].tostring()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name, typecode in SUMMARY_COLUMNS:
+            setattr(self, name, array(typecode, state[name]))
+
+    def add(self, bucket, count, depth):
+        buckets = self.buckets
+        if not buckets or bucket > buckets[-1]:
+            buckets.append(bucket)
+            self.counts.append(count)
+            self.depths.append(depth)
+            return
+        i = len(buckets) - 1 if bucket == buckets[-1] else bisect.bisect_left(buckets, bucket)
+        if buckets[i] == bucket:
+            self.counts[i] += count
+            if depth > self.depths[i]:
+                self.depths[i] = depth
+        else:
+            buckets.insert(i, bucket)
+            self.counts.insert(i, count)
+            self.depths.insert(i, depth)
+
+    def truncate(self, bucket):
+        """ Drop buckets from bucket on """
+        i = bisect.bisect_left(self.buckets, bucket)
+        for name, typecode in SUMMARY_COLUMNS:
+            del getattr(self, name)[i:]
+
+
+class LaneSummary:
+    """ Activity of one lane at every level of detail """
+    def __init__(self):
+        self.levels = [SummaryLevel()]
+        self.dirty_from = sys.maxint
+
+    def add(self, ypos, depth, count = 1):
+        bucket = ypos // LOD_BUCKET_HEIGHT
+        self.levels[0].add(bucket, count, depth)
+        if bucket < self.dirty_from:
+            self.dirty_from = bucket
+
+    def truncate(self, bucket):
+        """ Drop the counts from level 0 bucket on """
+        self.levels[0].truncate(bucket)
+        if bucket < self.dirty_from:
+            self.dirty_from = bucket
+
+    def merge(self, other):
+        """ Add the events counted by other """
+        base = other.levels[0]
+        for bucket, count, depth in zip(base.buckets, base.counts, base.depths):
+            self.levels[0].add(bucket, count, depth)
+        if base.buckets and base.buckets[0] < self.dirty_from:
+            self.dirty_from = base.buckets[0]
+
+    def level(self, k):
+        """ Level k, brought up to date with level 0 """
+        for level in self.levels[1:]:
+            level.stale_from = min(level.stale_from, self.dirty_from)
+        self.dirty_from = sys.maxint
+        while len(self.levels) <= k:
+            self.levels.append(SummaryLevel())
+        for j in range(1, k + 1):
+            level = self.levels[j]
+            if level.stale_from == sys.maxint:
+                continue
+            start = level.stale_from >> (LOD_LEVEL_SHIFT * j)
+            level.truncate(start)
+            lower = self.levels[j - 1]
+            i = bisect.bisect_left(lower.buckets, start << LOD_LEVEL_SHIFT)
+            for bucket, count, depth in zip(lower.buckets[i:], lower.counts[i:], lower.depths[i:]):
+                level.add(bucket >> LOD_LEVEL_SHIFT, count, depth)
+            level.stale_from = sys.maxint
+        return self.levels[k]
+
+    def draw(self, ctx, x, offset_y, h, zoom):
+        """ Draw h of ypos from offset_y, scaled by zoom, with x at the left of the lane """
+        k = lod_level(zoom)
+        level = self.level(k)
+        height = LOD_BUCKET_HEIGHT << (LOD_LEVEL_SHIFT * k)
+        full = height * LOD_FULL_DENSITY
+        buckets = level.buckets
+        i = bisect.bisect_left(buckets, int(offset_y) // height)
+        stop = bisect.bisect_right(buckets, int(offset_y + h) // height)
+        r, g, b, a = OVERVIEW_STYLE.fill_rgba
+        while i < stop:
+            density = min(level.counts[i] / full, 1.0)
+            ctx.rectangle(x, (buckets[i] * height - offset_y) * zoom,
+                          (level.depths[i] + 1) * BAR_WIDTH, max(height * zoom, 1))
+            ctx.set_source_rgba(r, g, b, a * (0.2 + 0.8 * density))
+            ctx.fill()
+            i += 1
 
 
-    def __gt__(self, other):
-        return self.ypos > other.ypos
+def lod_level(zoom):
+    """ Finest summary level whose buckets are at least LOD_MIN_PIXELS tall at zoom """
+    k = 0
+    while (LOD_BUCKET_HEIGHT << (LOD_LEVEL_SHIFT * k)) * zoom < LOD_MIN_PIXELS:
+        k += 1
+    return k
 
-    def __ge__(self, other):
-        return self.ypos >= other.ypos
 
+def summary_top(ypos, zoom):
+    """ Upper end of what a change at ypos redraws at zoom, the top of its summary bucket """
+    if zoom == 1.0:
+        return ypos
+    height = LOD_BUCKET_HEIGHT << (LOD_LEVEL_SHIFT * lod_level(zoom))
+    return ypos - ypos % height
 
-class LifelineEntity(YPosComparable):
-    def __init__(self, lifeline, ypos, event_type, stack):
-        YPosComparable.__init__(self, ypos)
+
+class LifelineEntity(object):
+    """ View of one event row in a lifeline's EventStore """
+    __slots__ = ("lifeline", "index")
+
+    def __init__(self, lifeline, index):
         self.lifeline = lifeline
-        self.event_type = event_type
-        self.stack = stack
-        self.name = ""
-        self.info = []
+        self.index = index
+
+    def __eq__(self, other):
+        return (isinstance(other, LifelineEntity)
+                and self.lifeline is other.lifeline and self.index == other.index)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self.lifeline), self.index))
+
+    @property
+    def ypos(self):
+        return self.lifeline.events.ypos[self.index]
+
+    @property
+    def event_type(self):
+        return EVENT_TYPES[self.lifeline.events.types[self.index]]
+
+    @property
+    def stack(self):
+        return self.lifeline.events.stacks[self.index]
+
+    @property
+    def name(self):
+        return self.lifeline.seqdata.strings.get(self.lifeline.events.names[self.index])
+
+    func_name = name
+    label = name
+
+    @property
+    def comm(self):
+        comm_idx = self.lifeline.events.comms[self.index]
+        if comm_idx < 0:
+            return None
+        return self.lifeline.seqdata.comms[comm_idx]
+
+    @property
+    def info(self):
+        return self.lifeline.events.info.get(self.index, [])
 
     def get_name(self):
         return self.name
@@ -62,7 +377,7 @@ class LifelineEntity(YPosComparable):
         return self.get_name()
 
     def add_info(self, line):
-        self.info.append(line.rstrip())
+        self.lifeline.events.info.setdefault(self.index, []).append(line.rstrip())
 
     def get_info_text(self):
         return "[{t}{name}]\ntpos: {tpos}\n{info}".format(
@@ -76,15 +391,22 @@ class LifelineEntity(YPosComparable):
         self.lifeline.shift_ypos(self.ypos, new_ypos)
 
 
-class StackFrame:
-    def __init__(self, func_name):
+class StackFrame(object):
+    """ Call stack frame, linked to its caller so that stack snapshots share tails """
+    __slots__ = ("func_name", "parent", "depth", "call_index", "return_index")
+
+    def __init__(self, func_name, parent = None):
         self.func_name = func_name
-        self.call_entity = None
-        self.return_entity = None
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 1
+        # Event rows of the call and of the return, -1 while there is none.
+        self.call_index = -1
+        self.return_index = -1
 
 class Communication:
-    def __init__(self):
-        self.comm_id = ""
+    def __init__(self, comm_id = "", index = -1):
+        self.comm_id = comm_id
+        self.index = index
         self.send_entity = None
         self.recv_entity = None
     
@@ -92,6 +414,12 @@ class Communication:
         if not self.send_entity or not self.recv_entity:
             return False
         return True
+
+    def span(self):
+        """ (upper, lower) ypos of the ends """
+        y0 = self.send_entity.ypos
+        y1 = self.recv_entity.ypos
+        return (y0, y1) if y0 <= y1 else (y1, y0)
     
     def __str__(self):
         return "[comm:{id} {src} -> {dst} ]".format(
@@ -103,62 +431,81 @@ class Communication:
     def get_name(self):
         return self.__str__()
 
+    def hit_test(self, x, y):
+        src = (self.send_entity.lifeline.bar_xpos(self.send_entity.stack, "c") + 2, self.send_entity.ypos)
+        dest = (self.recv_entity.lifeline.bar_xpos(self.recv_entity.stack, "c") + 2, self.recv_entity.ypos)
+        return len_point_to_line2(*((x, y) + src + dest)) < 16.0
+
     def get_info_text(self):
         return self.send_entity.get_info_text() + "\n\n--- TO ---\n\n" + self.recv_entity.get_info_text()
 
 
-BAR_WIDTH = 5
-
-SELECTED_BGCOLOR = '#0000FF'
-SELECTED_ALPHA = 0.2
-
-DEFAULT_PARAMS = {
-    'bgcolor': None,
-    'fontname': 'Serif',
-    'fontsize': 10,
-    'fontcolor': '#000000',
-    'textalign': 'center',
-    'text': None,
-    'linecolor': None,
-    'linewidth': 1.0,
-    'dash': [],
-    'associated': None,
-    'alpha': None,
-    'linealpha': None,
-}
-
-class ParamClass:
-    def __init__(self, d):
-        self.d = {}
-        self.d.update(DEFAULT_PARAMS)
-        self.d.update(d)
-    
-    def __getattr__(self, name):
-        return self.d[name]
-
-    def __setattr__(self, name, value):
-        if name == 'd':
-            self.__dict__['d'] = value
-        else:
-            self.__dict__['d'][name] = value
+# Lifeline attributes only valid while drawing.
+DRAW_ATTRS = ("ctx", "x", "y", "w", "h", "font", "last_stack")
 
-    def __hasattr__(self, name):
-        return name in self.d
+BAR_WIDTH = 5
+LANE_WIDTH = 150
+ENTITY_MAX_HEIGHT = 30
+COMM_BUCKET_HEIGHT = 1024
+# Communications taller than this are not put in comm buckets.
+LONG_COMM_HEIGHT = 4096
 
 class Lifeline:
     def __init__(self, seqdata, lifeline_id, start_ypos):
         self.seqdata = seqdata
         self.lifeline_id = lifeline_id
-        self.entity_list = []
+        self.events = EventStore()
         self.start_ypos = start_ypos
         self.end_ypos = None
         self.__current_ypos = start_ypos
-        self.current_stack = []
+        self.current_stack = None
         self.lifeline_name = str(lifeline_id)
         self.terminated = False
         self.lane = 0
         self.blocking = False
-        self.blocked_cmds = []
+        # The receive waiting for its send, then the commands held back after it.
+        self.blocked_cmds = deque()
+        self.blocked_ypos = None
+
+    def __getstate__(self):
+        # Stack frames are saved as rows (parent row, call event, return event)
+        # and rebuilt by restore_frames() once the string table is loaded.
+        state = self.__dict__.copy()
+        for name in DRAW_ATTRS:
+            state.pop(name, None)
+        rows = {None: -1}
+        parents = array('l')
+        calls = array('l')
+        returns = array('l')
+        def frame_row(stk):
+            chain = []
+            while stk not in rows:
+                chain.append(stk)
+                stk = stk.parent
+            for frm in reversed(chain):
+                rows[frm] = len(parents)
+                parents.append(rows[frm.parent])
+                calls.append(frm.call_index)
+                returns.append(frm.return_index)
+            return rows[chain[0]] if chain else rows[stk]
+        stack_rows = array('l', [frame_row(stk) for stk in self.events.stacks])
+        state["current_stack"] = frame_row(self.current_stack)
+        state["frame_rows"] = (parents.tostring(), calls.tostring(), returns.tostring(), stack_rows.tostring())
+        return state
+
+    def restore_frames(self):
+        parents, calls, returns, stack_rows = [array('l', col) for col in self.__dict__.pop("frame_rows")]
+        frames = []
+        strings = self.seqdata.strings.strings
+        names = self.events.names
+        for parent, call, ret in zip(parents, calls, returns):
+            frm = StackFrame(strings[names[call]], frames[parent] if parent >= 0 else None)
+            frm.call_index = call
+            frm.return_index = ret
+            frames.append(frm)
+        frames.append(None)
+        self.events.stacks = [frames[row] for row in stack_rows]
+        self.current_stack = frames[self.current_stack] if self.current_stack >= 0 else None
 
     def get_info_text(self):
         return "[Lifeline: {name}]\nid = {lid}".format(
@@ -182,26 +529,37 @@ class Lifeline:
     def get_display_name(self):
         return self.lifeline_name
 
-    def new_entity(self, event_type, add_ypos = 20):
-        entity = LifelineEntity(self, self.get_current_ypos(), event_type, self.current_stack)
-        self.entity_list.append(entity)
+    def new_entity(self, event_type, add_ypos = 20, name = None, comm = None):
+        idx = self.events.append(
+            event_type,
+            self.get_current_ypos(),
+            self.current_stack,
+            self.seqdata.strings.intern(name) if name is not None else -1,
+            comm.index if comm is not None else -1,
+        )
+        ypos = self.events.ypos[idx]
+        self.seqdata.mark_dirty(self.lane, ypos)
+        self.seqdata.lane_summaries[self.lane].add(ypos, self.events.depth[idx])
         self.set_current_ypos_least(self.get_current_ypos() + add_ypos)
-        return entity
+        return LifelineEntity(self, idx)
+
+    def entity(self, idx):
+        return LifelineEntity(self, idx)
 
     def stack_push(self, name):
         if self.seqdata.synchronized:
             self.current_ypos = self.seqdata.current_ypos
-        self.current_stack = self.current_stack[:]
-        frm = StackFrame(name)
-        self.current_stack.append(frm)
+        frm = StackFrame(name, self.current_stack)
+        self.current_stack = frm
+        self.seqdata.max_depth = max(self.seqdata.max_depth, frm.depth)
         return frm
 
     def stack_pop(self):
-        self.current_stack = self.current_stack[:]
-        self.current_stack.pop()
+        self.current_stack = self.current_stack.parent
 
     def put_thread_name(self, name):
         self.lifeline_name = name
+        self.seqdata.mark_dirty(self.lane, self.start_ypos)
 
     def bar_xpos(self, stk, align = "l"):
         if align == "c":
@@ -210,97 +568,61 @@ class Lifeline:
             align_int = BAR_WIDTH
         else:
             align_int = 0
-        return len(stk)*BAR_WIDTH + align_int + 20 + self.lane * 150
-
-    def parse_line_flags(self, p):
-        ctx = self.ctx
-        if p.linealpha is not None:
-            ctx.set_source_rgba(*StrToColor(p.linecolor) + (p.linealpha, ))
-        else:
-            ctx.set_source_rgb(*StrToColor(p.linecolor))
-
-        ctx.set_line_width(p.linewidth)
-        if p.dash:
-            ctx.set_dash(p.dash, 0)
-        else:
-            ctx.set_dash([], 0)
-
+        depth = stk.depth if stk is not None else 0
+        return depth*BAR_WIDTH + align_int + 20 + self.lane * LANE_WIDTH
 
-    def parse_fill_flags(self, p):
+    def set_line_style(self, style):
         ctx = self.ctx
-        if p.alpha is not None:
-            ctx.set_source_rgba(*StrToColor(p.bgcolor) + (p.alpha, ))
-        else:
-            ctx.set_source_rgb(*StrToColor(p.bgcolor))
+        ctx.set_source_rgba(*style.line_rgba)
+        ctx.set_line_width(style.linewidth)
+        ctx.set_dash(style.dash, 0)
 
-    def draw_line(self, **prms):
-        p = ParamClass(prms)
-        if self.only_check:
-            if len_point_to_line2(*(self.seqdata.selected_pos + p.src + p.dest)) < 16.0:
-                self.seqdata.selected_object = p.associated
-            return
-        
-        if p.associated and self.seqdata.selected_object == p.associated:
-            self.draw_line(
-                associated = None,
-                src = p.src,
-                dest = p.dest,
-                linewidth = 8.0,
-                linealpha = SELECTED_ALPHA,
-                linecolor = SELECTED_BGCOLOR,
-            )
+    def draw_line(self, style, src, dest, associated = None):
+        if associated is not None and self.seqdata.selected_object == associated:
+            self.draw_line(SELECTED_LINE_STYLE, src, dest)
             
-        self.ctx.move_to(p.src[0], p.src[1])
-        self.ctx.line_to(p.dest[0], p.dest[1])
-        self.parse_line_flags(p)
+        self.ctx.move_to(src[0], src[1])
+        self.ctx.line_to(dest[0], dest[1])
+        self.set_line_style(style)
         self.ctx.stroke()
 
 
-    def draw_box(self, **prms):
-        p = ParamClass(prms)
+    def draw_box(self, style, pos, size, text = None, associated = None):
         ctx = self.ctx
-        x0 = p.pos[0]
-        y0 = p.pos[1]
-        xs = p.size[0]
-        ys = p.size[1]
+        x0 = pos[0]
+        y0 = pos[1]
+        xs = size[0]
+        ys = size[1]
         
-        if self.only_check:
-            if ( self.seqdata.selected_pos and
-                x0 < self.seqdata.selected_pos[0] and y0 < self.seqdata.selected_pos[1] and
-                self.seqdata.selected_pos[0] < x0+xs and self.seqdata.selected_pos[1] < y0+ys):
-                    self.seqdata.selected_object = p.associated
-            return
-                
-        if p.associated and self.seqdata.selected_object == p.associated:
-            p.bgcolor = SELECTED_BGCOLOR
-            p.alpha = SELECTED_ALPHA
+        if associated is not None and self.seqdata.selected_object == associated:
+            style = style.selected()
 
-        if p.bgcolor is not None:
+        if style.fill_rgba is not None:
             ctx.rectangle(x0,y0,xs,ys)
-            self.parse_fill_flags(p)
+            ctx.set_source_rgba(*style.fill_rgba)
             ctx.fill()
 
-        if p.linecolor is not None:
+        if style.line_rgba is not None:
             ctx.rectangle(x0,y0,xs,ys)
-            self.parse_line_flags(p)
+            self.set_line_style(style)
             ctx.stroke()
 
-        if p.text is not None:
-            ctx.select_font_face(p.fontname, cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-            ctx.set_font_size(p.fontsize)
+        if text is not None:
+            if self.font != style.font:
+                ctx.select_font_face(style.font[0], cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+                ctx.set_font_size(style.font[1])
+                self.font = style.font
             
-            (x_bearing, y_bearing, width, height, x_advance, y_advance) = ctx.text_extents(p.text)
+            (x_bearing, y_bearing, width, height, x_advance, y_advance) = ctx.text_extents(text)
             
-            if p.textalign == "center":
+            if style.textalign == "center":
                 ctx.move_to(x0 + (xs - width)/2 , y0 + (ys + height)/2)
-            elif p.textalign == "left":
+            elif style.textalign == "left":
                 ctx.move_to(x0, y0 + (ys + height)/2)
-            elif p.textalign == "lefttop":
-                ctx.move_to(x0, y0 + height)
             else:
-                ctx.move_to(x0 + (xx - width)/2 , y0 + (ys + height)/2)
-            ctx.set_source_rgb(*StrToColor(p.fontcolor))
-            ctx.show_text(p.text)
+                ctx.move_to(x0, y0 + height)
+            ctx.set_source_rgba(*style.font_rgba)
+            ctx.show_text(text)
 
 
     def draw_mark(self, stk, ypos, label, associated):
@@ -312,81 +634,114 @@ class Lifeline:
         x1 = x + sz
         y1 = y + sz
         
-        common_params = {
-            "linecolor": "#FF0000",
-            "linewidth": 1.0,
-            "dash": [],
-        }
         self.draw_line(
+            MARK_LINE_STYLE,
             src = (x0, y0),
             dest = (x1, y1),
-            **common_params
         )
         self.draw_line(
+            MARK_LINE_STYLE,
             src = (x1, y0),
             dest = (x0, y1),
             associated = associated,
-            **common_params
         )
 
         self.draw_box(
+            MARK_LABEL_STYLE,
             pos = (x + 6, y - 10),
             size = (100,20),
             text = label,
-            textalign = "left",
-            linecolor = None,
             associated = associated,
         )
 
     def shift_ypos(self, ypos, new_ypos):
-        idx = bisect.bisect_left(self.entity_list, YPosComparable(ypos))
-        
-        biggest_ypos = 0
-        for i in range(idx, len(self.entity_list)):
-            self.entity_list[i].ypos += new_ypos - ypos
-            biggest_ypos = max(self.entity_list[i].ypos, biggest_ypos)
-
-
-    def draw(self, ctx, offset_x, offset_y, w, h, only_check = False):
+        idx = bisect.bisect_left(self.events.ypos, ypos)
+        self.events.shift_from(idx, new_ypos - ypos)
+        self.seqdata.events_moved(self.lane, min(ypos, new_ypos))
+
+
+    def hit_test_boxes(self, x, y):
+        """ Label box drawn at (x, y) in lifeline coordinates, or None """
+        events = self.events
+        ylist = events.ypos
+
+        # Only the few events just above y can have a box covering it.
+        idx = bisect.bisect_right(ylist, y) - 1
+        while idx >= 0 and ylist[idx] > y - ENTITY_MAX_HEIGHT:
+            ypos = ylist[idx]
+            event_type = EVENT_TYPES[events.types[idx]]
+            stk = events.stacks[idx]
+            if event_type == "call":
+                if in_box(x, y, self.bar_xpos(stk, "r") + 2, ypos, 100, 20):
+                    return self.entity(idx)
+            elif event_type in ("phase", "event"):
+                if in_box(x, y, self.bar_xpos(stk, "c") + 6, ypos, 100, 20):
+                    return self.entity(idx)
+            elif event_type == "lifeline_start":
+                if in_box(x, y, self.bar_xpos(stk, "r") - 40, ypos, 120, 30):
+                    return self
+            idx -= 1
+        return None
+
+    def hit_test_bars(self, x, y):
+        """ Call entity whose bar is drawn at (x, y), or None """
+        events = self.events
+        last = bisect.bisect_right(events.ypos, y) - 1
+
+        # Frames open just after the last event above y cover all bars at y.
+        stk = events.stacks[last] if last >= 0 else None
+        while stk is not None:
+            y0 = events.ypos[stk.call_index]
+            y1 = events.ypos[stk.return_index] if stk.return_index >= 0 else y + 1
+            if in_box(x, y, self.bar_xpos(stk), y0, BAR_WIDTH, y1 - y0):
+                return self.entity(stk.call_index)
+            stk = stk.parent
+        return None
+
+    def begin_draw(self, ctx, offset_x, offset_y, w, h):
         self.ctx = ctx
         self.x = offset_x
         self.y = offset_y
         self.w = w
         self.h = h
-        self.only_check = only_check
+        self.font = None
+
+    def underlabel_ypos(self, offset_y, h):
+        return min(offset_y + h - 40, self.end_ypos if self.end_ypos else offset_y + h - 40)
 
-        elist = self.entity_list
-        idx = bisect.bisect_left(elist, YPosComparable(self.y)) - 1
-        if idx == -1:
-            idx = 0
+    def draw(self, ctx, offset_x, offset_y, w, h):
+        self.begin_draw(ctx, offset_x, offset_y, w, h)
 
-        if elist:
-            self.last_stack = elist[max(idx-1, 0)].stack
+        events = self.events
+        ylist = events.ypos
+        idx = bisect.bisect_left(ylist, self.y - ENTITY_MAX_HEIGHT)
+
+        if idx > 0:
+            self.last_stack = events.stacks[idx-1]
         else:
-            self.last_stack = []
+            self.last_stack = None
             
-        stk = self.last_stack[:]
-        while stk:
+        stk = self.last_stack
+        while stk is not None:
             self.draw_call_base(stk)
-            stk.pop()
+            stk = stk.parent
             
         while True:
-            if idx >= len(elist) or elist[idx].ypos > self.y + self.h:
+            if idx >= len(ylist) or ylist[idx] > self.y + self.h:
                 break
-            draw_func = getattr(self, "draw_" + elist[idx].event_type)
-            draw_func(elist[idx])
-            self.last_stack = elist[idx].stack
+            draw_func = getattr(self, "draw_" + EVENT_TYPES[events.types[idx]])
+            draw_func(self.entity(idx))
+            self.last_stack = events.stacks[idx]
             idx += 1
         self.draw_all_return()
 
-        underlabel_ypos = min(self.y + h - 40, self.end_ypos if self.end_ypos else self.y + h - 40)
+    def draw_underlabel(self, ctx, offset_x, offset_y, w, h):
+        self.begin_draw(ctx, offset_x, offset_y, w, h)
+        underlabel_ypos = self.underlabel_ypos(self.y, h)
         self.draw_box(
+            LIFELINE_FOOTER_STYLE,
             text = self.get_display_name(),
-            textalign = 'center',
-            linecolor = None,
-            bgcolor = '#FFFFFF',
-            alpha = 0.8,
-            pos = (self.bar_xpos([], "r") - 30 - self.x, underlabel_ypos - self.y),
+            pos = (self.bar_xpos(None, "r") - 30 - self.x, underlabel_ypos - self.y),
             size = (120, 20),
             associated = self,
         )
@@ -395,14 +750,13 @@ class Lifeline:
     def draw_comm(self, comm):
         if not comm.is_complete():
             return
-        ctx = self.ctx
-        
         if comm.send_entity.ypos < comm.recv_entity.ypos:
-            linecolor = '#0000FF'
+            style = COMM_STYLE
         else:
-            linecolor = '#FF0000'
+            style = COMM_BACKWARD_STYLE
 
         self.draw_line(
+            style,
             src = (
                     comm.send_entity.lifeline.bar_xpos(comm.send_entity.stack, "c") + 2 - self.x, 
                     comm.send_entity.ypos - self.y
@@ -411,9 +765,6 @@ class Lifeline:
                     comm.recv_entity.lifeline.bar_xpos(comm.recv_entity.stack, "c") + 2 - self.x,
                     comm.recv_entity.ypos - self.y
                 ),
-            linewidth = 1.0,
-            linecolor = linecolor,
-            dash = [6,2],
             associated = comm,
         )
 
@@ -422,19 +773,15 @@ class Lifeline:
 
     def put_call(self, func_name):
         frm = self.stack_push(func_name)
-        entity = self.new_entity("call")
-        entity.func_name = func_name
-        entity.name = func_name
-        frm.call_entity = entity
+        entity = self.new_entity("call", name = func_name)
+        frm.call_index = entity.index
+        self.seqdata.name_index.add(func_name, self.lane, entity.ypos)
         return entity
 
     def draw_call(self, entity):
-        ctx = self.ctx
         self.draw_box(
+            CALL_LABEL_STYLE,
             text = entity.func_name,
-            textalign = 'left',
-            linecolor = None,
-            bgcolor = None,
             pos = (self.bar_xpos(entity.stack, "r") + 2 - self.x, entity.ypos - self.y),
             size = (100, 20),
             associated = entity,
@@ -442,49 +789,53 @@ class Lifeline:
 
         x0 = self.bar_xpos(entity.stack)
         y0 = entity.ypos - self.y
-        y1 = entity.stack[-1].return_entity.ypos - self.y if entity.stack[-1].return_entity else self.h + 10
+        stk = entity.stack
+        y1 = self.events.ypos[stk.return_index] - self.y if stk.return_index >= 0 else self.h + 10
         w = BAR_WIDTH
         h = y1 - y0
         
         self.draw_box(
+            CALL_BAR_STYLE,
             pos = (x0 - self.x, y0),
             size = (w,h),
-            linecolor = '#000000',
-            linewidth = 1.0,
-            associated = entity.stack[-1].call_entity,
+            associated = self.entity(stk.call_index),
         )
 
+    def restore_call(self, func_name, ypos):
+        """ Reopen a frame called at ypos, when resuming from an index checkpoint """
+        frm = self.stack_push(func_name)
+        idx = self.events.append("call", ypos, frm, self.seqdata.strings.intern(func_name), -1)
+        frm.call_index = idx
+
     def draw_call_base(self, stk):
         x0 = self.bar_xpos(stk)
         y0 = -2
-        y1 = stk[-1].return_entity.ypos - self.y if stk[-1].return_entity else self.h
+        y1 = self.events.ypos[stk.return_index] - self.y if stk.return_index >= 0 else self.h + 10
         w = BAR_WIDTH
         h = y1 - y0
         
         self.draw_box(
+            CALL_BAR_STYLE,
             pos = (x0 - self.x, y0),
             size = (w,h),
-            linecolor = '#000000',
-            linewidth = 1.0,
-            associated = stk[-1].call_entity,
+            associated = self.entity(stk.call_index),
         )
 
     def put_return(self):
-        if not self.current_stack:
+        if self.current_stack is None:
             return None
-        frm = self.current_stack[-1]
+        frm = self.current_stack
         self.stack_pop()
         entity = self.new_entity("return")
-        frm.return_entity = entity
+        frm.return_index = entity.index
         return entity
 
     def draw_return(self, entity):
         pass
 
     def put_phase(self, phase_name):
-        entity = self.new_entity("phase")
-        entity.func_name = phase_name
-        entity.name = phase_name
+        entity = self.new_entity("phase", name = phase_name)
+        self.seqdata.name_index.add(phase_name, self.lane, entity.ypos)
         return entity
 
     def draw_phase(self, entity):
@@ -492,25 +843,23 @@ class Lifeline:
         y = entity.ypos - self.y + 10
         
         self.draw_box(
+            PHASE_LABEL_STYLE,
             pos = (x + 6, y - 10),
             size = (100,20),
             text = entity.func_name,
-            textalign = "left",
-            linecolor = None,
             associated = entity,
         )
 
     def put_send(self, comm_obj):
-        entity = self.new_entity("send", 5)
-        entity.comm = comm_obj
+        entity = self.new_entity("send", 5, comm = comm_obj)
+        self.seqdata.name_index.add(comm_obj.comm_id, self.lane, entity.ypos)
         return entity
 
     def draw_send(self, entity):
         self.draw_comm(entity.comm)
 
     def put_recv(self, comm_obj):
-        entity = self.new_entity("recv", 5)
-        entity.comm = comm_obj
+        entity = self.new_entity("recv", 5, comm = comm_obj)
         return entity
 
     def draw_recv(self, entity):
@@ -521,12 +870,9 @@ class Lifeline:
         return entity
 
     def draw_lifeline_start(self, entity):
-        ctx = self.ctx
         self.draw_box(
+            LIFELINE_HEADER_STYLE,
             text = self.get_display_name(),
-            textalign = 'center',
-            linecolor = '#000000',
-            bgcolor = '#FFFEDD',
             pos = (self.bar_xpos(entity.stack, "r") - 40 - self.x, entity.ypos - self.y),
             size = (120, 30),
             associated = self,
@@ -534,9 +880,8 @@ class Lifeline:
 
 
     def put_event(self, label):
-        entity = self.new_entity("event", 20)
-        entity.label = label
-        entity.name = label
+        entity = self.new_entity("event", 20, name = label)
+        self.seqdata.name_index.add(label, self.lane, entity.ypos)
         return entity
 
     def draw_event(self, entity):
@@ -544,13 +889,22 @@ class Lifeline:
 
     def put_terminate(self):
         if self.end_ypos is not None:
-            return        
+            return
+        if self.blocking:
+            # Ended by its connection while waiting: the receive and the
+            # commands held back behind it are dropped with the lifeline.
+            cmd = self.blocked_cmds[0]
+            self.seqdata.diag.event("terminated_while_blocked", "%s", cmd)
+            self.seqdata.remove_waiting_receiver(cmd[3], self)
+            self.blocked_cmds.clear()
+            self.blocked_ypos = None
+            self.blocking = False
         entity = self.new_entity("terminate", 20)
 
-        while self.current_stack:
-            frm = self.current_stack[-1]
+        while self.current_stack is not None:
+            frm = self.current_stack
             self.stack_pop()
-            frm.return_entity = entity
+            frm.return_index = entity.index
 
         if self.seqdata.synchronized:
             self.current_ypos = self.seqdata.current_ypos
@@ -560,34 +914,47 @@ class Lifeline:
 
 
     def draw_terminate(self, entity):
-        self.draw_mark([0], entity.ypos, "Terminate", None)
+        self.draw_mark(StackFrame(None), entity.ypos, "Terminate", None)
 
     def put_info(self, infoline):
-        last_entity = self.entity_list[-1]
+        last_entity = self.entity(len(self.events) - 1)
         last_entity.add_info(infoline)
 
 
     def unblock(self):
-        print "[!Unblock]"
+        """ Replay the commands held back, once the send they wait for has come """
         if not self.blocking:
             return
+        self.seqdata.diag.event("unblock", "%s", self.get_id())
         self.blocking = False
-        runcmd = self.blocked_cmds
-        self.blocked_cmds = []
-        while runcmd:
-            cmd = runcmd.pop(0)
-            self.add_data_line(cmd)
-            if self.blocking:
-                self.blocked_cmds.extend(runcmd)
-                break
-
+        cmds = self.blocked_cmds
+        while cmds and not self.blocking:
+            self.add_data_line(cmds.popleft())
+
+    def give_up_recv(self, reason):
+        """ Put the waiting receive without its send, which may still come later """
+        cmd = self.blocked_cmds.popleft()
+        self.seqdata.diag.event(reason, "%s", cmd)
+        self.seqdata.remove_waiting_receiver(cmd[3], self)
+        comm = self.seqdata.new_communication(cmd[3])
+        if cmd[3] in self.seqdata.open_receiving:
+            self.seqdata.diag.event("duplicate_recv", "%s", cmd)
+        self.seqdata.open_receiving[cmd[3]] = comm
+        comm.recv_entity = self.put_recv(comm)
+        self.unblock()
 
     def add_data_line(self, cmd):
+        if self.terminated:
+            # Held back behind the TRM of this lifeline.
+            self.seqdata.diag.event("line_after_terminate", "%s %s", self.get_id(), cmd[0])
+            return
         if self.blocking:
-            print "[Blocked]", cmd
+            self.seqdata.diag.event("blocked_command", "%s", cmd)
             self.blocked_cmds.append(cmd)
-            if len(self.blocked_cmds) > 10:
-                self.unblock()
+            if len(self.blocked_cmds) > self.seqdata.RecvQueueLimit:
+                self.give_up_recv("recv_queue_full")
+            elif self.seqdata.current_ypos - self.blocked_ypos > self.seqdata.RecvTimeout:
+                self.give_up_recv("recv_timeout")
             return
 
         if cmd[0] == 'CAL' and len(cmd) >= 4:
@@ -599,26 +966,34 @@ class Lifeline:
         elif cmd[0] == 'TNM' and len(cmd) >= 3:
             self.put_thread_name(cmd[2])
         elif cmd[0] == 'SND' and len(cmd) >= 4:
-            if cmd[3] in self.seqdata.open_receiving:
-                comm = self.seqdata.open_receiving[cmd[3]]
-                del self.seqdata.open_receiving[cmd[3]]
-                comm.recv_entity.unblock()
+            seqdata = self.seqdata
+            if cmd[3] in seqdata.open_receiving:
+                comm = seqdata.open_receiving.pop(cmd[3])
+                seqdata.diag.event("late_send", "%s", cmd)
+                waiting = False
             else:
-                comm = Communication()
-                self.seqdata.open_sending[cmd[3]] = comm
+                comm = seqdata.new_communication(cmd[3])
+                if cmd[3] in seqdata.open_sending:
+                    seqdata.diag.event("duplicate_send", "%s", cmd)
+                seqdata.open_sending[cmd[3]] = comm
+                waiting = True
             comm.send_entity = self.put_send(comm)
+            seqdata.index_comm(comm)
+            if waiting:
+                seqdata.wake_receiver(cmd[3])
         elif cmd[0] == 'RCV' and len(cmd) >= 4:
             if cmd[3] in self.seqdata.open_sending:
-                comm = self.seqdata.open_sending[cmd[3]]
-                del self.seqdata.open_sending[cmd[3]]
+                comm = self.seqdata.open_sending.pop(cmd[3])
             else:
+                # Hold back this lifeline until the send comes.
                 self.blocking = True
-                self.blocked_cmds.append(cmd)
-                print "[!Blocked] by", cmd
+                self.blocked_ypos = self.seqdata.current_ypos
+                self.blocked_cmds.appendleft(cmd)
+                self.seqdata.waiting_receivers.setdefault(cmd[3], deque()).append(self)
+                self.seqdata.diag.event("blocked_by_recv", "%s", cmd)
                 return
-                #comm = Communication()
-                #self.seqdata.open_receiving[cmd[3]] = comm
             comm.recv_entity = self.put_recv(comm)
+            self.seqdata.index_comm(comm)
         elif cmd[0] == 'EVT' and len(cmd) >= 4:
             self.put_event(cmd[3])
 
@@ -627,63 +1002,394 @@ class Lifeline:
 
         elif cmd[0] == 'TRM' and len(cmd) >= 1:
             self.put_terminate()
-            self.used_lane.remove(self.lane)
+            self.seqdata.release_lane(self.lane)
         else:
-            print "Invalid command: ", cmd[0]
+            self.seqdata.diag.event("invalid_command", "%s", cmd[0])
 
 
 
 
 class SequenceData:
+    # A lifeline waiting for the send of a receive gives up after holding back
+    # this many commands, or once the log has grown this much below the receive.
+    RecvQueueLimit = 10000
+    RecvTimeout = 1000000
+
     def __init__(self):
         self.lifelines = {}
-        self.used_lane = set([])
+        # Lanes not in use are free_lanes and those from next_lane on.
+        self.free_lanes = []
+        self.next_lane = 0
         self.max_lane = 0
+        self.max_depth = 0
+        self.lane_lifelines = []
+        self.lane_starts = []
+        self.lane_summaries = []
+        # Lowest ypos of each lane whose events were shifted since its summary,
+        # or its name postings, were used.
+        self.stale_summaries = {}
+        self.stale_names = {}
+        # Lifelines by thread group, the part of their id before "/".
+        self.group_lifelines = {}
+        # Communications up to LONG_COMM_HEIGHT tall by the buckets they cross,
+        # and the taller ones with their ends, sorted by the upper end.
+        self.comm_buckets = {}
+        self.long_comms = []
+        self.long_tops = array('l')
+        self.long_bottoms = array('l')
+        # Lowest ypos of shifted events since comm_buckets was last used.
+        self.comms_moved_from = sys.maxint
+        self.dirty_lanes = {}
         self.current_ypos = 50
         self.synchronized = True
+        # Sends waiting for their receives, and receives given up waiting for
+        # their sends, by message id.
         self.open_sending = {}
         self.open_receiving = {}
-        self.selected_pos = None
+        # Lifelines held back by a receive, by message id of the receive.
+        self.waiting_receivers = {}
         self.selected_object = None
+        self.strings = StringTable()
+        self.comms = []
+        self.name_index = NameIndex()
         
-        self.raw_log = []
+        self.raw_log = RawLog()
+        self.diag = Diagnostics()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["selected_object"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for lifeline in self.lifelines.itervalues():
+            lifeline.restore_frames()
+
+    def new_communication(self, comm_id):
+        comm = Communication(comm_id, len(self.comms))
+        self.comms.append(comm)
+        return comm
+
+    def wake_receiver(self, comm_id):
+        waiting = self.waiting_receivers.get(comm_id)
+        if waiting:
+            lifeline = waiting.popleft()
+            if not waiting:
+                del self.waiting_receivers[comm_id]
+            lifeline.unblock()
+
+    def remove_waiting_receiver(self, comm_id, lifeline):
+        waiting = self.waiting_receivers[comm_id]
+        waiting.remove(lifeline)
+        if not waiting:
+            del self.waiting_receivers[comm_id]
 
     def search_unused_lane(self):
-        for i in range(1024):
-            if i not in self.used_lane:
-                self.used_lane.add(i)
-                self.max_lane = max(self.max_lane, i)
-                return i
-        raise "Too many lanes"
+        if self.free_lanes:
+            lane = heapq.heappop(self.free_lanes)
+        else:
+            lane = self.next_lane
+            self.next_lane += 1
+        self.max_lane = max(self.max_lane, lane)
+        return lane
+
+    def reserve_lane(self, lane):
+        if lane >= self.next_lane:
+            self.free_lanes.extend(range(self.next_lane, lane))
+            heapq.heapify(self.free_lanes)
+            self.next_lane = lane + 1
+        else:
+            self.free_lanes.remove(lane)
+            heapq.heapify(self.free_lanes)
+        self.max_lane = max(self.max_lane, lane)
+
+    def release_lane(self, lane):
+        heapq.heappush(self.free_lanes, lane)
 
     def get_lifeline(self, llid):
         if llid not in self.lifelines:
             self.lifelines[llid] = Lifeline(self, llid, self.current_ypos)
             self.lifelines[llid].lane = self.search_unused_lane()
+            self.index_lifeline(self.lifelines[llid])
             self.lifelines[llid].put_lifeline_start()
             
         return self.lifelines[llid]
+
+    def restore_lifeline(self, llid, lane, start_ypos):
+        """ Recreate a running lifeline, when resuming from an index checkpoint """
+        lifeline = Lifeline(self, llid, start_ypos)
+        lifeline.lane = lane
+        self.lifelines[llid] = lifeline
+        self.reserve_lane(lane)
+        self.index_lifeline(lifeline)
+        lifeline.events.append("lifeline_start", start_ypos, None, -1, -1)
+        return lifeline
+
+    def index_lifeline(self, lifeline):
+        while len(self.lane_lifelines) <= lifeline.lane:
+            self.lane_lifelines.append([])
+            self.lane_starts.append(array('l'))
+            self.lane_summaries.append(LaneSummary())
+        self.lane_lifelines[lifeline.lane].append(lifeline)
+        self.lane_starts[lifeline.lane].append(lifeline.start_ypos)
+        group = lifeline.lifeline_id.split("/", 1)[0]
+        self.group_lifelines.setdefault(group, []).append(lifeline)
+
+    def index_comm(self, comm):
+        if not comm.is_complete():
+            return
+        y0 = self.bucket_comm(comm)
+
+        lane0 = comm.send_entity.lifeline.lane
+        lane1 = comm.recv_entity.lifeline.lane
+        for lane in range(min(lane0, lane1), max(lane0, lane1) + 1):
+            self.mark_dirty(lane, y0)
+
+    def bucket_comm(self, comm, first = 0):
+        """ Put comm in the comm buckets it crosses from bucket first on, or with the long ones """
+        y0, y1 = comm.span()
+        if y1 - y0 > LONG_COMM_HEIGHT:
+            i = bisect.bisect_right(self.long_tops, y0)
+            self.long_comms.insert(i, comm)
+            self.long_tops.insert(i, y0)
+            self.long_bottoms.insert(i, y1)
+        else:
+            for bucket in range(max(y0 // COMM_BUCKET_HEIGHT, first), y1 // COMM_BUCKET_HEIGHT + 1):
+                self.comm_buckets.setdefault(bucket, []).append(comm)
+        return y0
+
+    def events_moved(self, lane, ypos):
+        """ Events of the lane from ypos downwards were shifted """
+        self.mark_dirty(lane, ypos)
+        for stale in (self.stale_summaries, self.stale_names):
+            if ypos < stale.get(lane, ypos + 1):
+                stale[lane] = ypos
+        self.comms_moved_from = min(self.comms_moved_from, ypos)
+
+    def lane_summary(self, lane):
+        """ Summary of the lane, counting again the events shifted since it was last used """
+        summary = self.lane_summaries[lane]
+        ypos = self.stale_summaries.pop(lane, None)
+        if ypos is not None:
+            bucket = ypos // LOD_BUCKET_HEIGHT
+            summary.truncate(bucket)
+            for lifeline in self.lane_lifelines[lane]:
+                events = lifeline.events
+                for idx in range(bisect.bisect_left(events.ypos, bucket * LOD_BUCKET_HEIGHT), len(events)):
+                    summary.add(events.ypos[idx], events.depth[idx])
+        return summary
+
+    def mark_dirty(self, lane, ypos):
+        """ Drawing of the lane may have changed from ypos downwards """
+        if ypos < self.dirty_lanes.get(lane, ypos + 1):
+            self.dirty_lanes[lane] = ypos
+
+    def take_dirty_regions(self):
+        """ (x0, y0, x1, y1) of the view drawn differently since the last call """
+        dirty = self.dirty_lanes
+        self.dirty_lanes = {}
+        regions = []
+        for lane, ypos in sorted(dirty.items()):
+            x0, x1 = self.lane_extent(lane)
+            # Neighbouring lanes changed from the same ypos, like by a comm, make one region.
+            if regions and regions[-1][1] == ypos and x0 <= regions[-1][2]:
+                x0 = regions.pop()[0]
+            regions.append((x0, ypos, x1, float("inf")))
+        return regions
+
+    def lane_extent(self, lane):
+        """ Range of x covered by drawing of the lane, in view coordinates """
+        return (lane * LANE_WIDTH + 35, lane * LANE_WIDTH + 180 + BAR_WIDTH * self.max_depth)
+
+    def visible_lanes(self, offset_x, w):
+        # See lane_extent().
+        lane_lo = int((offset_x - 180 - BAR_WIDTH * self.max_depth) // LANE_WIDTH)
+        lane_hi = int((offset_x + w - 35) // LANE_WIDTH)
+        return max(lane_lo, 0), min(lane_hi, len(self.lane_lifelines) - 1)
+
+    def visible_lifelines(self, offset_x, offset_y, w, h):
+        lane_lo, lane_hi = self.visible_lanes(offset_x, w)
+        result = []
+        for lane in range(lane_lo, lane_hi + 1):
+            lifelines = self.lane_lifelines[lane]
+            # Lifelines sharing a lane never overlap, so end_ypos grows with start_ypos.
+            i = bisect.bisect_right(self.lane_starts[lane], offset_y + h) - 1
+            while i >= 0:
+                lifeline = lifelines[i]
+                if lifeline.end_ypos and offset_y > lifeline.end_ypos:
+                    break
+                result.append(lifeline)
+                i -= 1
+        return result
+
+    def rebucket_comms(self):
+        """ Put the comms in the buckets they cross since events were shifted """
+        if self.comms_moved_from == sys.maxint:
+            return
+        # Shifted ends were and are below comms_moved_from, so only those buckets change.
+        first = self.comms_moved_from // COMM_BUCKET_HEIGHT
+        self.comms_moved_from = sys.maxint
+        top = first * COMM_BUCKET_HEIGHT
+        long_comms = zip(self.long_comms, self.long_tops, self.long_bottoms)
+        self.long_comms = []
+        self.long_tops = array('l')
+        self.long_bottoms = array('l')
+        for comm, y0, y1 in long_comms:
+            if y1 < top:
+                self.long_comms.append(comm)
+                self.long_tops.append(y0)
+                self.long_bottoms.append(y1)
+        for comm, y0, y1 in long_comms:
+            if y1 >= top:
+                self.bucket_comm(comm)
+        moved = {}
+        for bucket in [bucket for bucket in self.comm_buckets if bucket >= first]:
+            for comm in self.comm_buckets.pop(bucket):
+                moved[comm.index] = comm
+        for index in sorted(moved):
+            comm = moved[index]
+            y0, y1 = comm.span()
+            if y1 - y0 > LONG_COMM_HEIGHT:
+                # Out of its buckets before first too, which were not popped.
+                for bucket in range(y0 // COMM_BUCKET_HEIGHT, first):
+                    self.comm_buckets[bucket].remove(comm)
+            self.bucket_comm(comm, first)
+
+    def comms_in_range(self, y0, y1):
+        self.rebucket_comms()
+        result = []
+        seen = set()
+        for bucket in range(int(y0) // COMM_BUCKET_HEIGHT, int(y1) // COMM_BUCKET_HEIGHT + 1):
+            for comm in self.comm_buckets.get(bucket, ()):
+                if comm.index not in seen:
+                    seen.add(comm.index)
+                    result.append(comm)
+        long_comms = self.long_comms
+        bottoms = self.long_bottoms
+        for i in xrange(bisect.bisect_right(self.long_tops, y1)):
+            if bottoms[i] >= y0:
+                result.append(long_comms[i])
+        return result
     
-    def draw(self, ctx, offset_x, offset_y, w, h, only_check = False):
-        for key, lifeline in self.lifelines.items():
-            if lifeline.start_ypos > offset_y + h:
+    def draw(self, ctx, offset_x, offset_y, w, h):
+        self.draw_content(ctx, offset_x, offset_y, w, h)
+        self.draw_overlay(ctx, offset_x, offset_y, w, h)
+
+    def draw_overview(self, ctx, offset_x, offset_y, w, h, zoom):
+        """ Draw the activity of lanes over h of ypos from offset_y, scaled by zoom """
+        lane_lo, lane_hi = self.visible_lanes(offset_x, w)
+        for lane in range(lane_lo, lane_hi + 1):
+            self.lane_summary(lane).draw(ctx, lane * LANE_WIDTH + 20 - (offset_x - 50), offset_y, h, zoom)
+
+    def draw_overlay(self, ctx, offset_x, offset_y, w, h):
+        """ Draw the parts that stay fixed in the view, like lifeline names """
+        for lifeline in self.visible_lifelines(offset_x, offset_y, w, h):
+            lifeline.draw_underlabel(ctx, offset_x - 50, offset_y, w, h)
+
+    def draw_content(self, ctx, offset_x, offset_y, w, h):
+        visible = self.visible_lifelines(offset_x, offset_y, w, h)
+        for lifeline in visible:
+            lifeline.draw(ctx, offset_x - 50, offset_y, w, h)
+
+        # Comm lines crossing the view whose ends are not drawn by a lifeline.
+        drawn = set(visible)
+        lane_lo, lane_hi = self.visible_lanes(offset_x, w)
+        for comm in self.comms_in_range(offset_y, offset_y + h):
+            src = comm.send_entity.lifeline
+            dst = comm.recv_entity.lifeline
+            if src in drawn and offset_y - ENTITY_MAX_HEIGHT <= comm.send_entity.ypos <= offset_y + h:
+                continue
+            if dst in drawn and offset_y - ENTITY_MAX_HEIGHT <= comm.recv_entity.ypos <= offset_y + h:
                 continue
-            if lifeline.end_ypos and offset_y > lifeline.end_ypos:
+            if max(src.lane, dst.lane) < lane_lo or min(src.lane, dst.lane) > lane_hi:
                 continue
-            lifeline.draw(ctx, offset_x - 50, offset_y, w, h, only_check)
+            src.begin_draw(ctx, offset_x - 50, offset_y, w, h)
+            src.draw_comm(comm)
+
+    def names(self):
+        """ NameIndex of the log, posting again the names of events shifted since it was last used """
+        for lane, ypos in self.stale_names.iteritems():
+            self.name_index.drop(lane, ypos)
+            for lifeline in self.lane_lifelines[lane]:
+                events = lifeline.events
+                for idx in range(bisect.bisect_left(events.ypos, ypos), len(events)):
+                    event_type = EVENT_TYPES[events.types[idx]]
+                    if event_type == "send":
+                        name = self.comms[events.comms[idx]].comm_id
+                    elif event_type in ("call", "phase", "event"):
+                        name = self.strings.get(events.names[idx])
+                    else:
+                        continue
+                    self.name_index.add(name, lane, events.ypos[idx])
+        self.stale_names = {}
+        return self.name_index
+
+    def find_name(self, text, ypos, lane, backward = False):
+        """ (ypos, lane) of the next call, phase, event or send named with text """
+        return self.names().find(text, ypos, lane, backward)
+
+    def entity_at(self, lane, ypos):
+        """ Entity put at ypos in the lane, or None """
+        if lane >= len(self.lane_lifelines):
+            return None
+        i = bisect.bisect_right(self.lane_starts[lane], ypos) - 1
+        if i < 0:
+            return None
+        lifeline = self.lane_lifelines[lane][i]
+        ylist = lifeline.events.ypos
+        idx = bisect.bisect_left(ylist, ypos)
+        if idx < len(ylist) and ylist[idx] == ypos:
+            return lifeline.entity(idx)
+        return None
+
+    def hit_test(self, offset_x, offset_y, w, h, px, py):
+        """ Object drawn at (px, py) of the view at (offset_x, offset_y) """
+        x = px + offset_x - 50
+        y = py + offset_y
+
+        # Lifeline name labels stick to the bottom of the view and are drawn last.
+        for lifeline in self.visible_lifelines(offset_x + px, offset_y, 1, h):
+            if in_box(x, y, lifeline.bar_xpos(None, "r") - 30, lifeline.underlabel_ypos(offset_y, h), 120, 20):
+                return lifeline
+
+        candidates = self.visible_lifelines(offset_x + px, y - 30, 1, 30)
+        for lifeline in candidates:
+            obj = lifeline.hit_test_boxes(x, y)
+            if obj is not None:
+                return obj
+
+        for comm in self.comms_in_range(y - 4, y + 4):
+            if comm.hit_test(x, y):
+                return comm
+
+        for lifeline in candidates:
+            obj = lifeline.hit_test_bars(x, y)
+            if obj is not None:
+                return obj
+        return None
 
     def unblock_all(self):
-        for key, lifeline in self.lifelines.items():
-            lifeline.unblock()
+        """ At the end of the log, put the receives still waiting without their sends """
+        # In order of appearance, so that layouts resumed from an index agree.
+        lifelines = sorted(self.lifelines.values(), key = lambda ll: ll.start_ypos)
+        # Replaying a lifeline may wake up one before it, to wait again.
+        while any(lifeline.blocking for lifeline in lifelines):
+            for lifeline in lifelines:
+                while lifeline.blocking:
+                    lifeline.give_up_recv("recv_at_end")
+        self.diag.set("unmatched_send", len(self.open_sending))
+        self.diag.set("unmatched_recv", len(self.open_receiving))
         
     def keep_raw_log(self, line = "", arr = None):
         self.raw_log.append(line + (list2cmdline(arr) if arr else ""))
         
     def save_log_to(self, fn):
         f = open(fn, 'w')
-        for rlog in self.raw_log:
-            f.write(rlog + "\n")
-        f.close()
+        try:
+            self.raw_log.write_to(f)
+        finally:
+            f.close()
     
     def sync_ypos(self):
         if self.synchronized:
@@ -695,11 +1401,21 @@ class SequenceData:
         for key, ll in self.lifelines.items():
             ll.set_current_ypos_least(now_ypos)
         self.current_ypos = now_ypos
-        print "Sync:", self.current_ypos    
+        logger.debug("Sync: %d", self.current_ypos)
 
     def add_data_line(self, line, th_grp = "d"):
-        cmd = shlex.split(line.strip())
-        if not cmd:
+        self.add_data_cmd(parse_line(line), line, th_grp)
+
+    def add_data_cmds(self, batch, th_grp = "d"):
+        """ Add (cmd, line) pairs parsed with parse_line() """
+        for cmd, line in batch:
+            self.add_data_cmd(cmd, line, th_grp)
+
+    def add_data_cmd(self, cmd, line, th_grp = "d"):
+        if cmd is None:
+            self.diag.event("invalid_line", "%s", line.strip())
+            return
+        elif not cmd:
             return
         elif cmd[0] == '#':
             self.keep_raw_log(line = line.strip())
@@ -709,11 +1425,11 @@ class SequenceData:
             lifeline = self.get_lifeline(th_grp + "/" + cmd[1])
             cmd[1] = lifeline.get_id()
             if lifeline.terminated:
-                print "Thread", lifeline.get_id(), "already terminated command: ", cmd[0]
+                self.diag.event("line_after_terminate", "%s %s", lifeline.get_id(), cmd[0])
                 self.keep_raw_log(arr = cmd)
                 return
         else:
-            print "Incomplete command: ", cmd[0]
+            self.diag.event("incomplete_command", "%s", cmd[0])
             self.keep_raw_log(line = line)
             return
 
@@ -721,19 +1437,25 @@ class SequenceData:
         self.keep_raw_log(arr = cmd)
 
     def terminated_lifeline_group(self, group):
-        for key in self.lifelines:
-            if key.startswith(group):
-                if not self.lifelines[key].terminated:
-                    self.lifelines[key].put_terminate()
-                    self.used_lane.remove(self.lifelines[key].lane)
-                    self.keep_raw_log(arr = ['TRM', key])
+        for lifeline in self.group_lifelines.pop(group, ()):
+            if not lifeline.terminated:
+                lifeline.put_terminate()
+                self.release_lane(lifeline.lane)
+                self.keep_raw_log(arr = ['TRM', lifeline.get_id()])
 
     def read_file(self, filename):
-        for line in open(filename, 'r'):
-            self.add_data_line(line)
+        f = open(filename, 'rb')
+        if binlog.sniff(f.read(len(binlog.MAGIC))):
+            for batch in binlog.read_batches(f):
+                self.add_data_cmds(batch)
+        else:
+            f.seek(0)
+            for line in f:
+                self.add_data_line(line)
+        f.close()
 
     def get_width(self):
-        return self.max_lane * 150 + 300
+        return self.max_lane * LANE_WIDTH + 300
 
     def get_height(self):
         return self.current_ypos + 10
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import cairo
+from collections import OrderedDict
+
+TILE_SIZE = 256
+TILE_BYTES = TILE_SIZE * TILE_SIZE * 4
+
+
+class TileCache:
+    """ Rendered view split into fixed-size tiles, evicted in LRU order """
+    def __init__(self, render, budget = 64 * 1024 * 1024):
+        # render(ctx, offset_x, offset_y, w, h, zoom) draws one tile.
+        self.render = render
+        self.budget = budget
+        self.tiles = OrderedDict()
+
+    def get_tile(self, tx, ty, zoom):
+        key = (tx, ty, zoom)
+        surface = self.tiles.pop(key, None)
+        if surface is None:
+            surface = cairo.ImageSurface(cairo.FORMAT_RGB24, TILE_SIZE, TILE_SIZE)
+            ctx = cairo.Context(surface)
+            ctx.set_source_rgb(1.0, 1.0, 1.0)
+            ctx.paint()
+            self.render(ctx, tx * TILE_SIZE, ty * TILE_SIZE, TILE_SIZE, TILE_SIZE, zoom)
+        self.tiles[key] = surface
+        return surface
+
+    def evict(self):
+        while self.tiles and len(self.tiles) * TILE_BYTES > self.budget:
+            self.tiles.popitem(last = False)
+
+    def paint(self, ctx, offset_x, offset_y, w, h, zoom = 1.0):
+        offset_x = int(offset_x)
+        offset_y = int(offset_y)
+        for ty in range(offset_y // TILE_SIZE, (offset_y + h - 1) // TILE_SIZE + 1):
+            for tx in range(offset_x // TILE_SIZE, (offset_x + w - 1) // TILE_SIZE + 1):
+                tile = self.get_tile(tx, ty, zoom)
+                x = tx * TILE_SIZE - offset_x
+                y = ty * TILE_SIZE - offset_y
+                ctx.set_source_surface(tile, x, y)
+                ctx.rectangle(x, y, TILE_SIZE, TILE_SIZE)
+                ctx.fill()
+        self.evict()
+
+    def invalidate(self, x0, y0, x1, y1, zoom = None):
+        """ Drop tiles intersecting the rectangle, given in unzoomed view coordinates """
+        # zoom only scales the y axis.
+        for key in list(self.tiles):
+            tx, ty, tile_zoom = key
+            if zoom is not None and tile_zoom != zoom:
+                continue
+            if (tx * TILE_SIZE < x1 and x0 < (tx + 1) * TILE_SIZE and
+                ty * TILE_SIZE < y1 * tile_zoom and y0 * tile_zoom < (ty + 1) * TILE_SIZE):
+                del self.tiles[key]
+
+    def zooms(self):
+        """ Zooms some tiles are kept for """
+        return set(zoom for tx, ty, zoom in self.tiles)
+
+    def clear(self):
+        self.tiles.clear()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+# Cache of laid out logs, so that reopening an unchanged log skips parsing
+# and a log that has grown is parsed only from where its entry ends.
+#
+# An entry is a header pickle, checked before anything else is read, and
+# the zlib compressed pickle of the SequenceData. The header holds the
+# size, mtime and SHA-1 of the log bytes the SequenceData was built from.
+# Entries are evicted least recently used first when the cache directory
+# grows over its size limit.
+
+import os
+import gc
+import zlib
+import hashlib
+import cPickle as pickle
+
+from diagnostics import logger
+
+CACHE_VERSION = 10
+CACHE_SUFFIX = ".vzc"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def default_directory():
+    return os.environ.get("VIZEXEC_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "vizexec")
+
+
+def default_size_limit():
+    """ VIZEXEC_CACHE_SIZE in MB, 0 disables the cache """
+    return int(os.environ.get("VIZEXEC_CACHE_SIZE", "1024")) * 1024 * 1024
+
+
+class CacheEntry:
+    """ SequenceData built from the first size bytes of a log """
+    def __init__(self, seqdata, size, sha1, pending = "", binary = False, strings = None):
+        self.seqdata = seqdata
+        self.size = size
+        # SHA-1 object fed with the first size bytes, None if not computed.
+        self.sha1 = sha1
+        # Bytes read but not parsed yet, like an incomplete last line.
+        self.pending = pending
+        self.binary = binary
+        self.strings = strings if strings is not None else {}
+
+
+class TraceCache:
+    def __init__(self, directory = None, size_limit = None):
+        self.directory = directory if directory is not None else default_directory()
+        self.size_limit = size_limit if size_limit is not None else default_size_limit()
+
+    def enabled(self):
+        return self.size_limit > 0
+
+    def entry_filename(self, filename, th_grp):
+        key = hashlib.sha1(os.path.realpath(filename) + "\0" + th_grp).hexdigest()
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, filename, th_grp):
+        """ CacheEntry for the log, or None if there is none or the log was rewritten """
+        entry_filename = self.entry_filename(filename, th_grp)
+        try:
+            f = open(entry_filename, 'rb')
+        except IOError:
+            return None
+        try:
+            header = pickle.load(f)
+            if header.get("version") != CACHE_VERSION:
+                return None
+            st = os.stat(filename)
+            if st.st_size < header["size"]:
+                return None
+            sha1 = None
+            if st.st_size != header["size"] or st.st_mtime != header["mtime"]:
+                # Grown or touched: usable only if the cached part is unchanged.
+                sha1 = hash_prefix(filename, header["size"])
+                if sha1.hexdigest() != header["sha1"]:
+                    return None
+            seqdata = unpickle_without_gc(zlib.decompress(f.read()))
+        except (IOError, OSError, EOFError, zlib.error, pickle.UnpicklingError) as e:
+            logger.warning("Ignoring cache entry %s: %s", entry_filename, e)
+            return None
+        finally:
+            f.close()
+        # The mtime of entries orders them for eviction.
+        os.utime(entry_filename, None)
+        logger.info("Loaded %s from cache, %d bytes", filename, header["size"])
+        return CacheEntry(seqdata, header["size"], sha1, header["pending"], header["binary"], header["strings"])
+
+    def store(self, filename, th_grp, entry):
+        """ Save entry for the log read so far, then evict old entries """
+        self.write(filename, th_grp, self.snapshot(filename, entry))
+
+    def snapshot(self, filename, entry):
+        """ Header and pickled SequenceData of entry, the part that needs the SequenceData unchanged """
+        header = {
+            "version": CACHE_VERSION,
+            "size": entry.size,
+            "mtime": os.stat(filename).st_mtime,
+            "sha1": entry.sha1.hexdigest(),
+            "pending": entry.pending,
+            "binary": entry.binary,
+            "strings": entry.strings,
+        }
+        return header, pickle_without_gc(entry.seqdata)
+
+    def write(self, filename, th_grp, snapshot):
+        """ Compress and save a snapshot(), then evict old entries """
+        header, pickled = snapshot
+        data = zlib.compress(pickled, 1)
+        if len(data) > self.size_limit:
+            return
+        entry_filename = self.entry_filename(filename, th_grp)
+        tmpname = entry_filename + ".tmp"
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Written aside and renamed, so a reader never sees a partial entry.
+            f = open(tmpname, 'wb')
+            try:
+                pickle.dump(header, f, 2)
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmpname, entry_filename)
+        except (IOError, OSError) as e:
+            logger.warning("Can not save cache entry %s: %s", entry_filename, e)
+            return
+        logger.info("Cached %s, %d bytes", filename, len(data))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(self.directory, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.size_limit:
+                break
+            os.remove(path)
+            total -= size
+            logger.info("Evicted cache entry %s", path)
+
+
+# The cyclic garbage collector would rescan the heap many times over while
+# the objects of a large SequenceData are created or traversed.
+
+def unpickle_without_gc(data):
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def pickle_without_gc(obj):
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.dumps(obj, 2)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def hash_prefix(filename, size):
+    """ SHA-1 object fed with the first size bytes of filename """
+    sha1 = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        while size > 0:
+            data = f.read(min(size, HASH_CHUNK_SIZE))
+            if not data:
+                break
+            sha1.update(data)
+            size -= len(data)
+    finally:
+        f.close()
+    return sha1
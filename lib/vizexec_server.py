@@ -1,73 +1,356 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import stat
+import time
+import hashlib
+import select
+import socket
 import threading
-import SocketServer
 import StringIO
-SocketServer.TCPServer.allow_reuse_address = True
+from seqdata import SequenceData, parse_line
+from diagnostics import logger
+import binlog
+import logindex
+from tracecache import CacheEntry
+from parallelparse import LineChunks, parallel_parser
 
 
 class ReadThread(threading.Thread):
+    # Lines are parsed outside seqdata_lock and added in batches, each batch
+    # being committed after BatchLines lines or BatchSeconds seconds.
+    ChunkSize = 1024 * 1024
+    BatchLines = 10000
+    BatchSeconds = 0.05
+
     def __init__(self, fn, window):
         threading.Thread.__init__(self)
         self.fn = fn
         self.window = window
         self.thread_group = self.window.new_thread_group_id()
         self.seqdata = window.seqdata
+        self.size = 0
+        # Hash of the bytes read, kept only for logs that can be cached.
+        self.sha1 = None
         self.setDaemon(True)
 
     def run(self):
-        file = open(self.fn, 'r')
-        while True:
-            line = file.readline()
-            if not line:
-                break
+        # os.read returns what is available, so named pipes are shown as they are written.
+        fd = os.open(self.fn, os.O_RDONLY)
+        entry = self.load_cache(fd)
+        if entry is not None:
+            binary = entry.binary
+            head = entry.pending + self.read(fd)
+        else:
+            head = ""
+            while binlog.sniff(head) is None:
+                data = self.read(fd)
+                if not data:
+                    break
+                head += data
+            binary = binlog.sniff(head)
+            if binary:
+                head = head[len(binlog.MAGIC):]
+        if binary:
+            decoder = binlog.BinaryDecoder()
+            if entry is not None:
+                decoder.strings = entry.strings
+            self.read_binary(fd, head, decoder)
+            rest = str(decoder.pending)
+        else:
+            parser = None
+            st = os.fstat(fd)
+            if stat.S_ISREG(st.st_mode):
+                parser = parallel_parser(st.st_size - self.size)
+            if parser is not None:
+                rest = self.read_text_parallel(fd, head, parser)
+            else:
+                rest = self.read_text(fd, head)
+        os.close(fd)
+
+        if self.sha1 is not None and (entry is None or self.size > entry.size):
+            # Saved before the last incomplete line and unblock_all(), so
+            # that a grown log resumes as if it was read in one go. Only the
+            # pickling needs the lock, compressing and writing are done after.
+            cache = self.window.trace_cache
             with self.window.seqdata_lock:
-                self.seqdata.add_data_line(line, self.thread_group)
-                self.window.updated = True
-        self.seqdata.unblock_all()
-        self.seqdata.sync_ypos()
+                snapshot = cache.snapshot(self.fn, CacheEntry(
+                    self.seqdata, self.size, self.sha1, rest, binary, decoder.strings if binary else None))
+            cache.write(self.fn, self.thread_group, snapshot)
+        if rest and not binary:
+            self.commit([(parse_line(rest), rest)])
 
+        with self.window.seqdata_lock:
+            self.seqdata.unblock_all()
+            self.seqdata.sync_ypos()
+            self.seqdata.diag.log_summary()
+            self.window.request_redraw()
 
-class TCPLogHandler(SocketServer.BaseRequestHandler):
-    def setup(self):
-        self.window = self.server.window
-        self.thread_group = self.window.new_thread_group_id()
-        self.buf = ""
-        print "Connected, group = " , self.thread_group
+    def load_cache(self, fd):
+        """ Cache entry of the log if it has one, switching the window to its SequenceData """
+        cache = self.window.trace_cache
+        if (cache is None or not cache.enabled() or not stat.S_ISREG(os.fstat(fd).st_mode)
+                or self.seqdata.lifelines or self.seqdata.raw_log):
+            return None
+        entry = cache.load(self.fn, self.thread_group)
+        if entry is None:
+            self.sha1 = hashlib.sha1()
+            return None
+        with self.window.seqdata_lock:
+            if self.window.seqdata is self.seqdata:
+                self.window.seqdata = entry.seqdata
+                self.window.tile_cache.clear()
+                self.window.request_redraw()
+        self.seqdata = entry.seqdata
+        self.size = entry.size
+        self.sha1 = entry.sha1
+        os.lseek(fd, entry.size, os.SEEK_SET)
+        return entry
 
-    def handle(self):
-        while True:
-            idx = self.buf.find("\n")
-            if idx == -1:
-                recved = self.request.recv(4096)
-                if not recved:
-                    return
-                self.buf += recved
-                continue
-            line = self.buf[:idx]
-            self.buf = self.buf[idx + 1:]
-            print "Line is :" , line
-            with self.window.seqdata_lock:
-                self.window.seqdata.add_data_line(line, self.thread_group)
-                self.window.updated = True
+    def read(self, fd):
+        data = os.read(fd, self.ChunkSize)
+        self.size += len(data)
+        if self.sha1 is not None:
+            self.sha1.update(data)
+        return data
+
+    def read_text(self, fd, data):
+        """ Commit the complete lines, returns the incomplete last line """
+        rest = ""
+        batch = []
+        committed = time.time()
+        while data:
+            lines = (rest + data).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                batch.append((parse_line(line), line))
+                if len(batch) >= self.BatchLines:
+                    self.commit(batch)
+                    batch = []
+                    committed = time.time()
+            if batch and (len(data) < self.ChunkSize or time.time() - committed >= self.BatchSeconds):
+                self.commit(batch)
+                batch = []
+                committed = time.time()
+            data = self.read(fd)
+        self.commit(batch)
+        return rest
+
+    def read_text_parallel(self, fd, data, parser):
+        """ read_text() with the lines tokenized by parser """
+        chunks = LineChunks(lambda: self.read(fd), data)
+        try:
+            for key, batch in parser.parse(enumerate(chunks)):
+                for i in range(0, len(batch), self.BatchLines):
+                    self.commit(batch[i:i + self.BatchLines])
+        finally:
+            parser.close()
+        return chunks.rest
+
+    def read_binary(self, fd, data, decoder):
+        while data:
+            self.commit(decoder.feed(data))
+            data = self.read(fd)
 
-    def finish(self):
-        print "Disconnected, group = " , self.thread_group
+    def commit(self, batch):
+        with self.window.seqdata_lock:
+            self.seqdata.add_data_cmds(batch, self.thread_group)
+            self.window.request_redraw()
+
+
+class IndexThread(threading.Thread):
+    """ Opens a large log through its sidecar index, building the index if needed """
+    def __init__(self, fn, window):
+        threading.Thread.__init__(self)
+        self.fn = fn
+        self.window = window
+        self.seqdata = window.seqdata
+        self.setDaemon(True)
+
+    def run(self):
+        start = time.time()
+        seqdata = logindex.open_index(self.fn)
+        logger.info("Opened %s with index in %.1f sec", self.fn, time.time() - start)
+        seqdata.diag.log_summary()
         with self.window.seqdata_lock:
-            self.window.seqdata.terminated_lifeline_group(self.thread_group)
-            self.window.updated = True
+            # Another log may have been opened meanwhile.
+            if self.window.seqdata is not self.seqdata:
+                return
+            self.window.seqdata = seqdata
+            self.window.tile_cache.clear()
+            self.window.request_redraw()
 
-class TCPServerThread(threading.Thread):
+
+class LineFramer:
+    """ Splits a received byte stream into lines in one reusable buffer """
+    def __init__(self, size = 65536):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def recv_from(self, sock):
+        """ Receive once and return the completed lines, None when the peer has closed """
+        if self.end == len(self.buf):
+            self.make_room()
+        n = sock.recv_into(self.view[self.end:])
+        if n == 0:
+            return None
+        scan = self.end
+        self.end += n
+        return self.split_lines(scan)
+
+    def feed(self, data):
+        """ Add data received elsewhere and return the completed lines """
+        if len(self.buf) - self.end < len(data):
+            self.make_room(len(data))
+        scan = self.end
+        self.end += len(data)
+        self.buf[scan:self.end] = data
+        return self.split_lines(scan)
+
+    def split_lines(self, scan):
+        last = self.buf.rfind("\n", scan, self.end)
+        if last == -1:
+            return []
+        # All complete lines are copied out and split in one go.
+        lines = self.view[self.start:last].tobytes().split("\n")
+        self.start = last + 1
+        if self.start == self.end:
+            self.start = self.end = 0
+        return lines
+
+    def make_room(self, size = 0):
+        # Only the unfinished last line is kept; grow if it fills the buffer
+        # or size more bytes would not fit.
+        pending = self.end - self.start
+        if pending * 2 > len(self.buf) or pending + size > len(self.buf):
+            buf = bytearray(max(len(self.buf) * 2, pending + size))
+            buf[:pending] = self.view[self.start:self.end]
+            self.buf = buf
+            self.view = memoryview(buf)
+        else:
+            self.buf[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+
+class LogConnection:
+    """ Client connection sending a text or binary log """
+    RecvSize = 65536
+
+    def __init__(self, sock, thread_group):
+        self.sock = sock
+        self.thread_group = thread_group
+        self.framer = None
+        self.decoder = None
+        self.head = ""
+
+    def read_batch(self):
+        """ (cmd, line) pairs received so far, None when the peer has closed """
+        if self.framer is not None:
+            lines = self.framer.recv_from(self.sock)
+            if lines is None:
+                return None
+            return [(parse_line(line), line) for line in lines]
+
+        data = self.sock.recv(self.RecvSize)
+        if not data:
+            return None
+        if self.decoder is not None:
+            return self.decoder.feed(data)
+
+        # The format is known once the first bytes tell MAGIC apart.
+        self.head += data
+        binary = binlog.sniff(self.head)
+        if binary is None:
+            return []
+        head, self.head = self.head, None
+        if binary:
+            self.decoder = binlog.BinaryDecoder()
+            return self.decoder.feed(head[len(binlog.MAGIC):])
+        self.framer = LineFramer()
+        return [(parse_line(line), line) for line in self.framer.feed(head)]
+
+
+def new_poller():
+    """ (poll object, readable event) using epoll where there is one """
+    if hasattr(select, "epoll"):
+        return select.epoll(), select.EPOLLIN
+    return select.poll(), select.POLLIN
+
+
+class SelectServerThread(threading.Thread):
+    """ Log server handling all connections on one thread """
     def __init__(self, port, window):
         threading.Thread.__init__(self)
         self.port = port
         self.window = window
-        self.seqdata = window.seqdata
         self.setDaemon(True)
+        # Connections by file descriptor.
+        self.conns = {}
 
     def run(self):
-        server = SocketServer.ThreadingTCPServer(('', self.port), TCPLogHandler)
-        server.window = self.window
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('', self.port))
+        listener.listen(64)
+        self.poller, self.readable = new_poller()
+        self.poller.register(listener.fileno(), self.readable)
         while True:
-            server.handle_request()
+            events = self.poller.poll()
+            received = []
+            closed = []
+            for fd, event in events:
+                if fd == listener.fileno():
+                    self.accept(listener)
+                    continue
+                conn = self.conns[fd]
+                try:
+                    batch = conn.read_batch()
+                except socket.error:
+                    batch = None
+                if batch is None:
+                    closed.append(conn)
+                elif batch:
+                    received.append((conn, batch))
+
+            if received or closed:
+                self.commit(received, closed)
+
+    def accept(self, listener):
+        sock, addr = listener.accept()
+        conn = LogConnection(sock, self.window.new_thread_group_id())
+        self.conns[sock.fileno()] = conn
+        self.poller.register(sock.fileno(), self.readable)
+        logger.info("Connected, group = %s", conn.thread_group)
+
+    def apply(self, func, *args):
+        # An error in one batch must not stop the other connections from being read.
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Can not add the lines of a connection")
+
+    def commit(self, received, closed):
+        with self.window.seqdata_lock:
+            # The window may have been given another log meanwhile.
+            seqdata = self.window.seqdata
+            if not isinstance(seqdata, SequenceData):
+                # Opened with an index, which takes no lines.
+                seqdata.diag.count("dropped_lines", sum(len(batch) for conn, batch in received))
+            else:
+                for conn, batch in received:
+                    seqdata.diag.count("received_lines", len(batch))
+                    self.apply(seqdata.add_data_cmds, batch, conn.thread_group)
+                for conn in closed:
+                    self.apply(seqdata.terminated_lifeline_group, conn.thread_group)
+            self.window.request_redraw()
+
+        for conn in closed:
+            fd = conn.sock.fileno()
+            self.poller.unregister(fd)
+            del self.conns[fd]
+            conn.sock.close()
+            logger.info("Disconnected, group = %s", conn.thread_group)
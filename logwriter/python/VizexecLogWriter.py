@@ -2,10 +2,47 @@
 
 import os
 import sys
+import time
+import atexit
+import heapq
+import fnmatch
+import itertools
 import threading
 import socket
+import struct
 
-time_counter = 0
+# Markers are numbered from one counter; next() on it is atomic.
+time_counter = itertools.count(1)
+
+# Markers of each thread are kept in its own buffer, which LogWriteThread
+# drains every FLUSH_INTERVAL seconds.
+FLUSH_INTERVAL = 0.05
+
+# Markers buffered per thread before VIZEXEC_OVERFLOW takes effect:
+#   block  wait until the buffer is written (default)
+#   drop   drop new calls with everything they contain, events and phases
+#   sample like drop, but keep one of VIZEXEC_SAMPLE_RATE calls
+# Sending, receiving and thread names are never dropped.
+LOG_BUFFER_MAX = 65536
+DROPPABLE = frozenset(["CAL", "RET", "EVT", "PHS", "INF"])
+
+# Binary format, read by lib/binlog.py of the viewer.
+BINARY_MAGIC = "\x89VZB\r\n\x1a\n"
+BINARY_STRING = 0
+BINARY_COMMENT = 255
+BINARY_RECORDS = {
+    "CAL": (1, "IQI"),
+    "RET": (2, "IQ"),
+    "PHS": (3, "IQI"),
+    "SND": (4, "IQI"),
+    "RCV": (5, "IQI"),
+    "EVT": (6, "IQI"),
+    "INF": (7, "II"),
+    "TNM": (8, "II"),
+    "TRM": (9, "IQ"),
+}
+BINARY_STRING_HEADER = struct.Struct("<BII")
+binary_strings = {}
 
 # for internal
 def build_id(params):
@@ -13,8 +50,17 @@ def build_id(params):
 
 write_log_raw = None
 flash_log_raw = None
+close_log_raw = None
 
 tracer_data = threading.local()
+buffer_data = threading.local()
+thread_buffers = []
+thread_buffers_lock = threading.Lock()
+log_write_thread = None
+start_thread = None
+overflow_policy = "block"
+sample_rate = 100
+dropped_count = 0
 
 
 def DoNothing(*prms):
@@ -23,12 +69,30 @@ def DoNothing(*prms):
 def start():
     """ Start LogWriter """
     global log_file
-    global write_log_raw, flush_log_raw
+    global write_log_raw, flush_log_raw, close_log_raw
+    global format_record, format_comment
+    global buffer_data, thread_buffers, log_write_thread, start_thread
+    global overflow_policy, sample_rate, dropped_count
 
     if "VIZEXEC_LOGFILE" in os.environ:
         log_file_name = os.environ["VIZEXEC_LOGFILE"]
     else:
         log_file_name = "vizexec.log"
+    if os.environ.get("VIZEXEC_LOGFORMAT") == "binary":
+        format_record = format_binary_record
+        format_comment = format_binary_comment
+    else:
+        format_record = format_text_record
+        format_comment = format_text_comment
+    overflow_policy = os.environ.get("VIZEXEC_OVERFLOW", "block")
+    if overflow_policy not in ("block", "drop", "sample"):
+        raise ValueError("Unknown VIZEXEC_OVERFLOW: " + overflow_policy)
+    sample_rate = int(os.environ.get("VIZEXEC_SAMPLE_RATE", "100"))
+    dropped_count = 0
+    binary_strings.clear()
+    buffer_data = threading.local()
+    thread_buffers = []
+    start_thread = threading.currentThread()
     
     
     print "VizEXEC: Wait for log writing"
@@ -36,36 +100,211 @@ def start():
         scheme, host, port = log_file_name.split(':')
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect((host.strip(), int(port.strip())))
-        write_log_raw = sock.send
+        write_log_raw = sock.sendall
         flush_log_raw = DoNothing
+        close_log_raw = sock.close
+        write_log_header()
     else:
-        log_file = open(log_file_name, 'w')
+        log_file = open(log_file_name, 'wb')
         write_log_raw = log_file.write
         flush_log_raw = log_file.flush
+        close_log_raw = log_file.close
+        write_log_header()
         write_log_comment("Start VizEXEC Log")
         write_log_comment("writer: python-vlw")
+
+    log_write_thread = LogWriteThread()
+    log_write_thread.start()
     print "VizEXEC: Start"
 
+def stop():
+    """ Write the buffered markers and stop LogWriter """
+    global write_log_raw, log_write_thread
+    if not log_write_thread:
+        return
+    log_write_thread.stop()
+    log_write_thread = None
+    if dropped_count:
+        write_log_comment("dropped {0} markers".format(dropped_count))
+    write_buffered()
+    close_log_raw()
+    write_log_raw = None
+
+atexit.register(stop)
+
+
+class ThreadBuffer:
+    """ Markers of one thread waiting for LogWriteThread """
+    def __init__(self):
+        self.thread = threading.currentThread()
+        self.thread_id = str(id(self.thread))
+        self.records = []
+        # Depth of the dropped call being skipped, 0 when not skipping.
+        self.skip_depth = 0
+        self.sample_counter = itertools.count()
+
+    def add(self, logtype, params, timed):
+        if self.skip_depth or len(self.records) >= LOG_BUFFER_MAX:
+            if not self.admit(logtype):
+                return
+        # Numbered only now, so that waiting for room does not reorder markers.
+        seq = next(time_counter)
+        if timed:
+            self.records.append((seq, logtype, self.thread_id, seq) + params)
+        else:
+            self.records.append((seq, logtype, self.thread_id) + params)
+
+    def admit(self, logtype):
+        """ False if the marker is dropped by overflow_policy """
+        global dropped_count
+        if self.skip_depth:
+            if logtype == "CAL":
+                self.skip_depth += 1
+            elif logtype == "RET":
+                self.skip_depth -= 1
+            if logtype not in DROPPABLE:
+                return True
+        elif logtype not in DROPPABLE or logtype == "RET":
+            return True
+        elif overflow_policy == "block":
+            self.wait_for_room()
+            return True
+        elif overflow_policy == "sample" and next(self.sample_counter) % sample_rate == 0:
+            return True
+        elif logtype == "CAL":
+            self.skip_depth = 1
+        dropped_count += 1
+        return False
+
+    def wait_for_room(self):
+        while len(self.records) >= LOG_BUFFER_MAX and log_write_thread:
+            log_write_thread.wakeup.set()
+            time.sleep(0.001)
+
+    def take(self):
+        # Appending threads only add after n, so this needs no lock.
+        n = len(self.records)
+        taken = self.records[:n]
+        del self.records[:n]
+        return taken
+
+
+class LogWriteThread(threading.Thread):
+    """ Writes the buffered markers of all threads in counter order """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.wakeup = threading.Event()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            write_buffered()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        self.join()
+
+
+def new_buffer():
+    buf = buffer_data.buffer = ThreadBuffer()
+    with thread_buffers_lock:
+        thread_buffers.append(buf)
+    return buf
 
+def write_buffered():
+    with thread_buffers_lock:
+        buffers = list(thread_buffers)
+    taken = []
+    for buf in buffers:
+        records = buf.take()
+        if records:
+            taken.append(records)
+        elif not buf.thread.isAlive() and buf.thread is not start_thread:
+            # The main thread is not alive any more while atexit runs stop().
+            with thread_buffers_lock:
+                thread_buffers.remove(buf)
+    if not taken:
+        return
+    out = []
+    for record in heapq.merge(*taken):
+        if record[1] == "#":
+            out.append(format_comment(record[3]))
+        else:
+            out.append(format_record(record))
+    write_log_raw("".join(out))
+    flush_log_raw()
 
 
 def write_log(logtype, *params):
-    global time_counter
-    time_counter += 1
-    write_log_notime(logtype, *((time_counter,) + params))
+    if write_log_raw:
+        try:
+            buf = buffer_data.buffer
+        except AttributeError:
+            buf = new_buffer()
+        buf.add(logtype, params, True)
+
+def write_log_header():
+    if format_record is format_binary_record:
+        write_log_raw(BINARY_MAGIC)
 
 def write_log_comment(cmt):
-    write_log_raw("# "+cmt+"\n")
-    flush_log_raw()
+    write_log_notime("#", cmt)
 
 def write_log_notime(logtype, *params):
-    if not write_log_raw:
-        return
-    line = str(logtype) + " " + str(id(threading.currentThread()))
-    for p in params:
-        line += ' "{0}"'.format(str(p))
-    write_log_raw(line+"\n")
-    flush_log_raw()
+    if write_log_raw:
+        try:
+            buf = buffer_data.buffer
+        except AttributeError:
+            buf = new_buffer()
+        buf.add(logtype, params, False)
+
+# Buffered records are (seq, logtype, thread id, params...).
+TEXT_FORMATS = ['%s %s' + ' "%s"' * n + '\n' for n in range(8)]
+
+def format_text_record(record):
+    return TEXT_FORMATS[len(record) - 3] % record[1:]
+
+def format_text_comment(cmt):
+    return "# " + cmt + "\n"
+
+def binary_string_id(s):
+    """ Id of s, sending a string record the first time s is used """
+    sid = binary_strings.get(s)
+    if sid is None:
+        sid = len(binary_strings)
+        write_log_raw(BINARY_STRING_HEADER.pack(BINARY_STRING, 4 + len(s), sid) + s)
+        binary_strings[s] = sid
+    return sid
+
+def binary_packer(rtype, fields):
+    packer = struct.Struct("<BI" + fields)
+    size = packer.size - 5
+    sid = binary_string_id
+    if fields == "IQI":
+        return lambda r: packer.pack(rtype, size, sid(r[2]), r[3], sid(str(r[4])))
+    if fields == "IQ":
+        return lambda r: packer.pack(rtype, size, sid(r[2]), r[3])
+    return lambda r: packer.pack(rtype, size, sid(r[2]), sid(str(r[3])))
+
+BINARY_PACKERS = dict(
+    (logtype, binary_packer(rtype, fields))
+    for logtype, (rtype, fields) in BINARY_RECORDS.items())
+
+def format_binary_record(record):
+    pack = BINARY_PACKERS.get(record[1])
+    if pack is None:
+        return ""
+    return pack(record)
+
+def format_binary_comment(cmt):
+    return struct.pack("<BI", BINARY_COMMENT, len(cmt)) + cmt
+
+format_record = format_text_record
+format_comment = format_text_comment
 
 def call(func_name):
     """ Marker for call """
@@ -125,14 +364,75 @@ def phase(pname):
 
 
 
-def __trace_func(frame, event, arg):
-    if event == "call":
-        call(frame.f_code.co_name)
-    if event == "return":
-        ret()
-    return __trace_func
+class Tracer:
+    """ Profile function marking the calls which pass the filters """
+    def __init__(self, include_modules, exclude_modules, include_functions,
+                 exclude_functions, max_depth, sample_rate):
+        self.include_modules = include_modules
+        self.exclude_modules = [__name__] + list(exclude_modules or [])
+        self.include_functions = include_functions
+        self.exclude_functions = exclude_functions or []
+        self.max_depth = max_depth if max_depth is not None else sys.maxint
+        self.sample_rate = sample_rate
+        self.sample_counter = itertools.count()
+        # code object -> function name, or None when filtered out
+        self.names = {}
+        # Frames whose call has been marked, innermost last.
+        self.marked = []
+        # Frame of a call left out by sampling, with everything it calls.
+        self.skipped = None
+
+    def filter(self, frame):
+        module = frame.f_globals.get("__name__", "")
+        name = frame.f_code.co_name
+        if (match_any(module, self.exclude_modules) or
+            match_any(name, self.exclude_functions)):
+            return None
+        if self.include_modules is not None and not match_any(module, self.include_modules):
+            return None
+        if self.include_functions is not None and not match_any(name, self.include_functions):
+            return None
+        return name
+
+    def profile(self, frame, event, arg):
+        if event == "call":
+            if self.skipped is not None:
+                return
+            try:
+                name = self.names[frame.f_code]
+            except KeyError:
+                name = self.names[frame.f_code] = self.filter(frame)
+            if name is None or len(self.marked) >= self.max_depth:
+                return
+            if not self.marked and next(self.sample_counter) % self.sample_rate:
+                self.skipped = frame
+                return
+            self.marked.append(frame)
+            call(name)
+        elif event == "return":
+            if self.skipped is not None:
+                if frame is self.skipped:
+                    self.skipped = None
+            elif self.marked and self.marked[-1] is frame:
+                self.marked.pop()
+                ret()
+
+
+def match_any(name, patterns):
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
 
-def set_trace():
+def set_trace(include_modules = None, exclude_modules = None,
+              include_functions = None, exclude_functions = None,
+              max_depth = None, sample_rate = 1):
+    """ Mark calls of the current thread, filtered by lists of fnmatch patterns """
+    # max_depth limits the nesting of marked calls. With sample_rate N, one
+    # in N outermost marked calls is traced, together with what it calls.
     tracer_data.enabled = True
-    sys.settrace(__trace_func)
+    sys.setprofile(Tracer(include_modules, exclude_modules, include_functions,
+                          exclude_functions, max_depth, sample_rate).profile)
 
+def unset_trace():
+    sys.setprofile(None)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+#   python -m unittest discover -s test
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from seqdata import SequenceData, EVENT_TYPES, parse_line
+
+
+def feed(seqdata, group, lines):
+    seqdata.add_data_cmds([(parse_line(line), line) for line in lines], group)
+
+
+def event_types(lifeline):
+    return [EVENT_TYPES[code] for code in lifeline.events.types]
+
+
+class TerminateWhileBlockedTest(unittest.TestCase):
+    def setUp(self):
+        self.seqdata = SequenceData()
+        feed(self.seqdata, "g1", ["CAL a 0 f", "RCV a 0 m"])
+        self.blocked = self.seqdata.lifelines["g1/a"]
+        self.assertTrue(self.blocked.blocking)
+        # The connection of g1 closes while a waits.
+        self.seqdata.terminated_lifeline_group("g1")
+
+    def test_receive_dropped(self):
+        self.assertFalse(self.blocked.blocking)
+        self.assertFalse(self.blocked.blocked_cmds)
+        self.assertEqual(self.seqdata.waiting_receivers, {})
+        self.seqdata.unblock_all()
+        self.assertEqual(event_types(self.blocked), ["lifeline_start", "call", "terminate"])
+
+    def test_send_after_terminate(self):
+        feed(self.seqdata, "g2", ["SND b 0 m", "EVT b 0 e"])
+        other = self.seqdata.lifelines["g2/b"]
+        self.assertEqual(other.lane, self.blocked.lane)
+        self.seqdata.unblock_all()
+        self.assertEqual(event_types(self.blocked), ["lifeline_start", "call", "terminate"])
+        self.assertEqual(event_types(other), ["lifeline_start", "send", "event"])
+        self.assertEqual(self.seqdata.diag.get("terminated_while_blocked"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 sys.path.append("./lib")
 
+# Batch rendering must not need GTK or a display.
+if __name__ == "__main__" and "-o" in sys.argv[1:]:
+    import batch_render
+    sys.exit(batch_render.main(sys.argv[1:]))
+
 try:
     import pygtk
     pygtk.require("2.8")
@@ -14,14 +20,19 @@ try:
     import gtk.glade
     import cairo
     import pango
-    import time
 except:
     sys.exit(1)
 
+import math
 import threading
 import gobject
 
-from seqdata import SequenceData
+from seqdata import SequenceData, summary_top
+from logindex import WindowedLog
+from tracecache import TraceCache
+from tilecache import TileCache
+from redrawscheduler import RedrawScheduler
+from diagnostics import set_verbosity
 from vizexec_server import *
 
 
@@ -31,7 +42,13 @@ class VizexecGUI:
     def __init__(self):
         self.seqdata = None
         self.current_thread_group_id_max = 0
-        self.UpdateInterval = 10
+        # Vertical scale of the view, below 1.0 lanes are drawn as summaries.
+        self.zoom = 1.0
+        self.MaxFramesPerSecond = 30
+        self.TileCacheBudget = 64 * 1024 * 1024
+        # Larger files are opened through a sidecar index, see logindex.py.
+        self.IndexedOpenSize = 64 * 1024 * 1024
+        self.trace_cache = TraceCache()
         self.seqdata_lock = threading.RLock()
         self.mouse_dragging = False
 
@@ -49,6 +66,7 @@ class VizexecGUI:
         self.import_control("TvwInfo")
         self.import_control("DlgRunServer")
         self.import_control("EntPortNum")
+        self.import_control("EntSearch")
         self.window.show()
         
         self.hadjust = gtk.Adjustment()
@@ -62,15 +80,17 @@ class VizexecGUI:
         self.drawing_scroll.set_vadjustment(self.vadjust)
 
         self.back_buffer = None
+        # SequenceData the back buffer was last painted from.
+        self.painted_seqdata = None
         self.update_back_buffer()
+        self.tile_cache = TileCache(self.render_tile, self.TileCacheBudget)
 
 
         self.EntPortNum.set_text("5112")
 
         self.new_data()
         self.fit_figure_size()
-        self.updated = False
-        gobject.timeout_add(self.UpdateInterval, self.update_timeout)
+        self.redraw_scheduler = RedrawScheduler(self.update_frame, gobject.timeout_add, self.MaxFramesPerSecond)
 
         flt = gtk.FileFilter()
         flt.set_name("ログファイル")
@@ -92,14 +112,16 @@ class VizexecGUI:
         return "g" + str(self.current_thread_group_id_max)
 
     def update_back_buffer(self):
+        """ Fit the back buffer to the drawing area, True if it was made anew """
         alloc = self.drawing_area.get_allocation()
         
         if (self.back_buffer
             and self.back_buffer.get_width() == alloc.width
             and self.back_buffer.get_height() == alloc.height):
-            return
+            return False
 
         self.back_buffer = cairo.ImageSurface(cairo.FORMAT_RGB24, alloc.width, alloc.height)
+        return True
         
         
 
@@ -110,8 +132,8 @@ class VizexecGUI:
         if self.seqdata.get_width() > alloc.width:
             self.hadjust.set_upper(self.seqdata.get_width() + 60)
             self.hadjust.set_page_size(alloc.width)
-        if self.seqdata.get_height() > alloc.height:
-            self.vadjust.set_upper(self.seqdata.get_height() + 60)
+        if self.seqdata.get_height() * self.zoom > alloc.height:
+            self.vadjust.set_upper(self.seqdata.get_height() * self.zoom + 60)
             self.vadjust.set_page_size(alloc.height)
 
         if is_max:
@@ -141,50 +163,147 @@ class VizexecGUI:
 
     def drawing_area_expose_event_cb(self, w, e):
         self.redraw()
+
+    def drawing_area_scroll_event_cb(self, w, e):
+        if not e.state & gtk.gdk.CONTROL_MASK:
+            return False
+        if e.direction == gtk.gdk.SCROLL_UP:
+            self.set_zoom(self.zoom * 2, e.y)
+        elif e.direction == gtk.gdk.SCROLL_DOWN:
+            self.set_zoom(self.zoom / 2, e.y)
+        return True
+
+    def set_zoom(self, zoom, anchor_y = None):
+        """ Change the zoom, keeping the ypos at anchor_y of the view in place """
+        alloc = self.drawing_area.get_allocation()
+        with self.seqdata_lock:
+            height = self.seqdata.get_height()
+        # Zoomed out no further than the whole log fitting in the view.
+        zoom = max(min(zoom, 1.0), min(float(alloc.height) / height, 1.0))
+        if zoom == self.zoom:
+            return
+        if anchor_y is None:
+            anchor_y = alloc.height / 2
+        ypos = (self.vadjust.get_value() + anchor_y) / self.zoom
+        self.zoom = zoom
+        self.vadjust.set_upper(max(height * zoom + 60, alloc.height))
+        self.vadjust.set_page_size(alloc.height)
+        self.vadjust.set_value(min(max(ypos * zoom - anchor_y, 0), self.vadjust.get_upper() - alloc.height))
+        self.redraw()
     
-    def update_timeout(self):
-        time.sleep(0.001)
-        if self.updated:
-            self.redraw()
-            self.updated = False
-        gobject.timeout_add(self.UpdateInterval, self.update_timeout)
-
-    def redraw(self, check_first = False):
+    def request_redraw(self):
+        """ Draw what changed in seqdata at the next frame, callable from any thread """
+        self.redraw_scheduler.request()
+
+    def update_frame(self):
+        """ Repaint the parts of the view seqdata changed since the last frame """
+        with self.seqdata_lock:
+            if self.update_back_buffer() or self.seqdata is not self.painted_seqdata:
+                self.redraw()
+                return
+            regions = self.invalidate_tiles()
+            scroll = (self.hadjust.get_value(), self.vadjust.get_value())
+            self.fit_figure_size()
+            if scroll != (self.hadjust.get_value(), self.vadjust.get_value()):
+                # Following the end of the log redrew all of the view.
+                return
+            rects = self.view_rects(regions)
+            if rects:
+                self.paint(rects)
+
+    def redraw(self):
         with self.seqdata_lock:
             self.update_back_buffer()
             self.fit_figure_size()
-            offset_x = self.hadjust.get_value()
-            offset_y = self.vadjust.get_value()
-
-
+            self.invalidate_tiles()
             alloc = self.drawing_area.get_allocation()
-            w,h = alloc.width, alloc.height
-
-            ctx = cairo.Context(self.back_buffer)
-            drawarea_ctx = self.drawing_area.window.cairo_create()
-            # ctx = self.drawing_area.window.cairo_create()
-            ctx.set_source_rgb(1.0,1.0,1.0)
-            ctx.rectangle(0,0, w,h)
-            ctx.fill()
-            
-            if check_first:
-                self.seqdata.draw(ctx, offset_x, offset_y, w, h, True)
-            self.seqdata.draw(ctx, offset_x, offset_y, w, h)
-            
-            drawarea_ctx.set_source_surface(self.back_buffer, 0, 0)
-            drawarea_ctx.paint()
+            self.paint([(0, 0, alloc.width, alloc.height)])
 
+    def paint(self, rects):
+        """ Repaint the (x, y, w, h) rectangles of the view """
+        offset_x = int(self.hadjust.get_value())
+        offset_y = int(self.vadjust.get_value())
+        alloc = self.drawing_area.get_allocation()
+        w,h = alloc.width, alloc.height
+
+        # Tiles are painted over the bounding box of the rectangles, clipped to them.
+        x0 = min(x for x, y, rw, rh in rects)
+        y0 = min(y for x, y, rw, rh in rects)
+        x1 = max(x + rw for x, y, rw, rh in rects)
+        y1 = max(y + rh for x, y, rw, rh in rects)
+
+        ctx = cairo.Context(self.back_buffer)
+        for rect in rects:
+            ctx.rectangle(*rect)
+        ctx.clip()
+        ctx.translate(x0, y0)
+        self.tile_cache.paint(ctx, offset_x + x0, offset_y + y0, x1 - x0, y1 - y0, self.zoom)
+        ctx.translate(-x0, -y0)
+        if self.zoom == 1.0:
+            self.seqdata.draw_overlay(ctx, offset_x, offset_y, w, h)
+        self.painted_seqdata = self.seqdata
+
+        drawarea_ctx = self.drawing_area.window.cairo_create()
+        for rect in rects:
+            drawarea_ctx.rectangle(*rect)
+        drawarea_ctx.clip()
+        drawarea_ctx.set_source_surface(self.back_buffer, 0, 0)
+        drawarea_ctx.paint()
+
+    def view_rects(self, regions):
+        """ (x, y, w, h) of the parts of the view within regions of seqdata """
+        offset_x = int(self.hadjust.get_value())
+        offset_y = int(self.vadjust.get_value())
+        alloc = self.drawing_area.get_allocation()
+        rects = []
+        for x0, y0, x1, y1 in regions:
+            x0 = max(int(x0) - offset_x, 0)
+            x1 = min(int(math.ceil(x1)) - offset_x, alloc.width)
+            y0 = max(int(summary_top(y0, self.zoom) * self.zoom) - offset_y, 0)
+            y1 = min(y1 * self.zoom - offset_y, alloc.height)
+            if x0 < x1 and y0 < y1:
+                rects.append((x0, y0, x1 - x0, int(math.ceil(y1)) - y0))
+        return rects
+
+
+    def render_tile(self, ctx, offset_x, offset_y, w, h, zoom):
+        if zoom == 1.0:
+            self.seqdata.draw_content(ctx, offset_x, offset_y, w, h)
+        else:
+            self.seqdata.draw_overview(ctx, offset_x, offset_y / zoom, w, h / zoom, zoom)
+
+    def invalidate_tiles(self):
+        """ Drop the tiles seqdata changed, returns its dirty regions """
+        regions = self.seqdata.take_dirty_regions()
+        for zoom in self.tile_cache.zooms():
+            for x0, y0, x1, y1 in regions:
+                self.tile_cache.invalidate(x0, summary_top(y0, zoom), x1, y1, zoom)
+        return regions
 
     def new_data(self):
         self.seqdata = SequenceData()
+        self.zoom = 1.0
+        self.search_text = None
+        self.search_pos = None
+        # Lifeline ids start over, so a log read first always gets the
+        # thread group its cache entry was saved with.
+        self.current_thread_group_id_max = 0
+        self.tile_cache.clear()
         self.redraw()
 
     def open_new(self, filename):
         self.new_data()
-        self.open_append(filename)
+        if os.path.isfile(filename) and os.path.getsize(filename) >= self.IndexedOpenSize:
+            index_thread = IndexThread(filename, self)
+            index_thread.start()
+        else:
+            self.open_append(filename)
         self.window.set_title(WINDOW_TITLE + " - File " + filename)
 
     def open_append(self, filename):
+        if isinstance(self.seqdata, WindowedLog):
+            self.TbfInfo.set_text("Can not append to a log opened with an index.")
+            return
         read_thread = ReadThread(filename, self)
         read_thread.start()
 
@@ -220,16 +339,84 @@ class VizexecGUI:
         self.AboutDialog.run()
         self.AboutDialog.hide()
 
+    def EntSearch_activate_cb(self, e):
+        self.search(False)
+
+    def BtnSearchNext_clicked_cb(self, e):
+        self.search(False)
+
+    def BtnSearchPrev_clicked_cb(self, e):
+        self.search(True)
+
+    def search(self, backward):
+        """ Jump to the next or previous entity named with the text of the search box """
+        text = self.EntSearch.get_text()
+        if not text:
+            return
+        with self.seqdata_lock:
+            if text != self.search_text or self.search_pos is None:
+                # A new search starts from the top of the view.
+                self.search_pos = (int(self.vadjust.get_value() / self.zoom), -1)
+            ypos, lane = self.search_pos
+            match = self.seqdata.find_name(text, ypos, lane, backward)
+            if match is None:
+                # Wrap around.
+                start = sys.maxint if backward else -1
+                match = self.seqdata.find_name(text, start, start, backward)
+            self.search_text = text
+            if match is None:
+                self.search_pos = None
+                self.TbfInfo.set_text("Not found: " + text)
+                return
+            self.search_pos = match
+            ypos, lane = match
+            entity = self.seqdata.entity_at(lane, ypos)
+            self.seqdata.selected_object = entity
+            self.tile_cache.clear()
+            x0, x1 = self.seqdata.lane_extent(lane)
+        if entity is not None:
+            self.TbfInfo.set_text(entity.get_info_text())
+        alloc = self.drawing_area.get_allocation()
+        self.fit_figure_size()
+        self.hadjust.set_value(max(x0 - alloc.width / 4, 0))
+        self.vadjust.set_value(max(ypos * self.zoom - alloc.height / 3, 0))
+        self.redraw()
+
+    def MniZoomIn_activate_cb(self, e):
+        self.set_zoom(self.zoom * 2)
+
+    def MniZoomOut_activate_cb(self, e):
+        self.set_zoom(self.zoom / 2)
+
+    def MniZoom100_activate_cb(self, e):
+        self.set_zoom(1.0)
+
+    def MniZoomFit_activate_cb(self, e):
+        self.set_zoom(0.0)
+
+    def MniDiagnostics_activate_cb(self, e):
+        with self.seqdata_lock:
+            self.TbfInfo.set_text(self.seqdata.diag.summary())
+
     def drawing_area_button_press_event_cb(self, e, data):
         self.mouse_dragging = True
         self.mouse_dragging_start = (
             self.hadjust.get_value() + data.x,
             self.vadjust.get_value() + data.y
         )
-        self.seqdata.selected_object = None
-        self.seqdata.selected_pos = (data.x,data.y)
-        self.redraw(True)
-        self.seqdata.selected_pos = None
+        alloc = self.drawing_area.get_allocation()
+        with self.seqdata_lock:
+            if self.zoom != 1.0:
+                # Summaries are not selectable.
+                selected = self.seqdata.selected_object
+            else:
+                selected = self.seqdata.hit_test(
+                    int(self.hadjust.get_value()), int(self.vadjust.get_value()),
+                    alloc.width, alloc.height, data.x, data.y)
+            if selected != self.seqdata.selected_object:
+                self.seqdata.selected_object = selected
+                self.tile_cache.clear()
+        self.redraw()
         
         if self.seqdata.selected_object:
             obj = self.seqdata.selected_object
@@ -250,7 +437,7 @@ class VizexecGUI:
             self.vadjust.set_value(self.mouse_dragging_start[1] - data.y)
 
     def open_server(self, portnum):
-        server_thread = TCPServerThread(portnum, self)
+        server_thread = SelectServerThread(portnum, self)
         server_thread.start()
         
         self.window.set_title(WINDOW_TITLE + " - Server *:" + str(portnum))
@@ -274,12 +461,20 @@ class VizexecGUI:
                 self.seqdata.save_log_to(self.DlgSaveFile.get_filename())
 
 if __name__ == "__main__":
+    args = sys.argv[1:]
+    verbosity = 0
+    while args and args[0] in ("-v", "-vv"):
+        verbosity += len(args.pop(0)) - 1
+    set_verbosity(verbosity)
+
+    # Reading threads run while the main loop waits, and ask it for frames.
+    gobject.threads_init()
     mainwindow = VizexecGUI()
-    if len(sys.argv) >= 2:
-        if sys.argv[1] == "-s":
-            mainwindow.open_server(int(sys.argv[2]))
+    if len(args) >= 1:
+        if args[0] == "-s":
+            mainwindow.open_server(int(args[1]))
         else:
-            mainwindow.open_new(sys.argv[1])
+            mainwindow.open_new(args[0])
     gtk.main()
 
 